@@ -0,0 +1,290 @@
+"""JSON API (v1) поверх тех же таблиц, что и HTML-страницы.
+
+Списки отдаются с курсорной пагинацией (after/before, limit), поле fields
+ограничивает набор колонок (тяжелые поля вроде протокола целиком не
+выбираются, если их не запросили), updated_since возвращает только
+изменившиеся записи в порядке изменения - для инкрементальной синхронизации.
+Пакетные эндпоинты создают и обновляют много записей одной транзакцией.
+
+Доступ - по той же сессии, что и HTML-страницы: администратору доступно все,
+пользователю - чтение новостей и дел, свои протоколы и создание протоколов.
+"""
+from flask import Blueprint, jsonify, request, session
+
+from bulk import IMPORT_SPECS, RowError, check_references
+import db
+import reports
+import writer
+from cache import cache
+from compression import PACKED_COLUMNS, pack_values, unpack_row
+from db import get_db
+from migrations import SEARCH_INDEXES, index_search, unindex_search
+from pagination import MAX_PAGE_SIZE, PAGE_SIZE, paginate
+from principal import principals
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Максимум записей в одном пакетном запросе
+MAX_BATCH_SIZE = 1000
+
+# Описание ресурсов: колонки, колонки по умолчанию, права пользователя
+RESOURCES = {
+    'news': {
+        'columns': ('id', 'title', 'content', 'date', 'created_at', 'updated_at'),
+        'user_read': True,
+    },
+    'cases': {
+        'columns': ('id', 'title', 'description', 'case_number', 'assigned_to', 'status',
+                    'created_at', 'updated_at'),
+        'user_read': True,
+    },
+    'protocols': {
+        'columns': ('id', 'case_id', 'user_id', 'title', 'content', 'protocol_number',
+                    'created_at', 'updated_at'),
+        # Текст протокола большой - только по явному запросу fields=...,content
+        'default': ('id', 'case_id', 'user_id', 'title', 'protocol_number',
+                    'created_at', 'updated_at'),
+        'user_read': True,
+        'user_create': True,
+        'owner': 'user_id',
+    },
+    'users': {
+        # Пароль через API не отдается
+        'columns': ('id', 'full_name', 'username', 'experience', 'education', 'rank', 'status',
+                    'created_at', 'updated_at'),
+    },
+    'employees': {
+        'columns': ('id', 'full_name', 'position', 'department', 'created_at', 'updated_at'),
+    },
+}
+
+
+class ApiError(Exception):
+    """Ошибка запроса, возвращаемая клиенту в виде JSON"""
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+@bp.errorhandler(ApiError)
+def handle_api_error(error):
+    body = {'error': error.message}
+    if error.details:
+        body['details'] = error.details
+    return jsonify(body), error.status
+
+
+def _resource(name, write=False):
+    """Описание ресурса с проверкой прав текущей сессии"""
+    spec = RESOURCES.get(name)
+    if spec is None:
+        raise ApiError('Неизвестный ресурс', 404)
+    if session.get('admin'):
+        return spec
+    if not session.get('user_id'):
+        raise ApiError('Требуется вход в систему', 401)
+    allowed = spec.get('user_create') if write else spec.get('user_read')
+    if not allowed:
+        raise ApiError('Недостаточно прав', 403)
+    return spec
+
+
+def _owner_scope(spec):
+    """Условие видимости записей для пользователя (как в view_protocol)"""
+    owner = spec.get('owner')
+    if owner and not session.get('admin'):
+        return [f'{owner} = ?'], [session['user_id']]
+    return [], []
+
+
+def _fields(spec):
+    requested = request.args.get('fields')
+    if not requested:
+        return spec.get('default', spec['columns'])
+    fields = tuple(dict.fromkeys(f.strip() for f in requested.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in spec['columns']]
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def _limit():
+    limit = request.args.get('limit', type=int) or PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+@bp.route('/reports')
+def get_reports():
+    """Сводки по делам и протоколам (только администратор)"""
+    if not session.get('admin'):
+        raise ApiError('Недостаточно прав', 403 if session.get('user_id') else 401)
+    conn = get_db()
+    return jsonify({'data': {
+        'cases_by_status': reports.summary(conn, 'cases_by_status'),
+        'case_workload': reports.case_workload(conn),
+        'top_cases': [dict(zip(row.keys(), row)) for row in reports.top_cases(conn, _limit())],
+        'top_users': [dict(zip(row.keys(), row)) for row in reports.top_users(conn, _limit())],
+        'protocols_by_day': [dict(zip(row.keys(), row)) for row in reports.protocols_by_day(conn)],
+    }})
+
+
+@bp.route('/<name>')
+def list_records(name):
+    """Страница записей ресурса"""
+    spec = _resource(name)
+    fields = _fields(spec)
+    where, params = _owner_scope(spec)
+
+    since = request.args.get('updated_since')
+    if since:
+        # Изменения - по возрастанию (updated_at, id), чтобы синхронизацию можно было продолжить
+        keys = (('updated_at', 'updated_at'), ('id', 'id'))
+        where.append('updated_at >= ?')
+        params.append(since)
+        descending = False
+    else:
+        keys = (('created_at', 'created_at'), ('id', 'id'))
+        descending = True
+
+    # Ключи сортировки нужны для курсора, даже если их не запросили
+    columns = tuple(dict.fromkeys(fields + tuple(field for _, field in keys)))
+    page = paginate(get_db(), f'SELECT {", ".join(columns)} FROM {name}', keys,
+                    where=where, params=params, per_page=_limit(), descending=descending)
+    rows = [unpack_row(name, row) for row in page]
+    return jsonify({
+        'data': [{field: row[field] for field in fields} for row in rows],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+@bp.route('/<name>/<int:record_id>')
+def get_record(name, record_id):
+    """Одна запись ресурса"""
+    spec = _resource(name)
+    fields = _fields(spec)
+    where, params = _owner_scope(spec)
+    where.insert(0, 'id = ?')
+    params.insert(0, record_id)
+    row = get_db().execute(f'SELECT {", ".join(fields)} FROM {name} WHERE {" AND ".join(where)}',
+                           params).fetchone()
+    if row is None:
+        raise ApiError('Запись не найдена', 404)
+    row = unpack_row(name, row)
+    return jsonify({'data': {field: row[field] for field in fields}})
+
+
+def _validate_create(name, record):
+    if name == 'protocols' and not session.get('admin'):
+        # Пользователь создает протоколы только от своего имени - до проверки полей
+        record = {**record, 'user_id': session['user_id']}
+    values = {}
+    for column, convert in IMPORT_SPECS[name].items():
+        values[column] = convert(record.get(column))
+    return values
+
+
+def _validate_update(name, record):
+    if not isinstance(record.get('id'), int):
+        raise RowError('не указан id записи')
+    converters = IMPORT_SPECS[name]
+    changes = {}
+    for column, value in record.items():
+        if column == 'id':
+            continue
+        if column not in converters:
+            raise RowError(f'поле {column!r} нельзя изменить')
+        changes[column] = converters[column](value)
+    if not changes:
+        raise RowError('нет изменяемых полей')
+    return record['id'], changes
+
+
+@bp.route('/<name>/batch', methods=['POST'])
+def batch(name):
+    """Создать и/или обновить записи одной транзакцией: {"create": [...], "update": [...]}"""
+    _resource(name, write=True)
+    if name not in IMPORT_SPECS:
+        raise ApiError('Ресурс не поддерживает запись', 405)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        raise ApiError('Ожидается JSON-объект с полями create и/или update')
+    creates = payload.get('create') or []
+    updates = payload.get('update') or []
+    if not isinstance(creates, list) or not isinstance(updates, list):
+        raise ApiError('create и update должны быть списками')
+    if updates and not session.get('admin'):
+        raise ApiError('Недостаточно прав', 403)
+    if len(creates) + len(updates) > MAX_BATCH_SIZE:
+        raise ApiError(f'Не более {MAX_BATCH_SIZE} записей за запрос', 413)
+
+    errors = []
+    rows = []
+    for index, record in enumerate(creates):
+        try:
+            if not isinstance(record, dict):
+                raise RowError('ожидается объект')
+            rows.append(_validate_create(name, record))
+        except RowError as e:
+            errors.append({'op': 'create', 'index': index, 'error': str(e)})
+    changes = []
+    for index, record in enumerate(updates):
+        try:
+            if not isinstance(record, dict):
+                raise RowError('ожидается объект')
+            changes.append((index, *_validate_update(name, record)))
+        except RowError as e:
+            errors.append({'op': 'update', 'index': index, 'error': str(e)})
+    if errors:
+        raise ApiError('Ошибки в данных, ничего не сохранено', 422, errors)
+
+    def write(conn):
+        # Ссылки проверяются в той же транзакции, что и запись
+        errors = []
+        known = set()
+        for op, items in (('create', enumerate(rows)), ('update', ((i, f) for i, _, f in changes))):
+            for index, values in items:
+                try:
+                    check_references(conn, name, values, known)
+                except RowError as e:
+                    errors.append({'op': op, 'index': index, 'error': str(e)})
+        if errors:
+            raise ApiError('Ошибки в данных, ничего не сохранено', 422, errors)
+
+        columns = tuple(IMPORT_SPECS[name])
+        insert = f'INSERT INTO {name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        created_ids = [db.insert(conn, insert, pack_values(conn, name, columns, [values[c] for c in columns]))
+                       for values in rows]
+        # Поиск по таблицам со сжатым текстом обновляется здесь, а не триггерами
+        search = name in PACKED_COLUMNS
+        if search and created_ids:
+            index_search(conn, name, f'id IN ({", ".join("?" * len(created_ids))})', created_ids)
+        for index, record_id, fields in changes:
+            reindex = search and not set(fields).isdisjoint(SEARCH_INDEXES[name])
+            if reindex:
+                unindex_search(conn, name, 'id = ?', (record_id,))
+            assignments = ', '.join(f'{column} = ?' for column in fields)
+            cursor = conn.execute(f'UPDATE {name} SET {assignments} WHERE id = ?',
+                                  (*pack_values(conn, name, fields, fields.values()), record_id))
+            if cursor.rowcount == 0:
+                errors.append({'op': 'update', 'index': index, 'error': 'запись не найдена'})
+            elif reindex:
+                index_search(conn, name, 'id = ?', (record_id,))
+        if errors:
+            # Исключение откатывает точку сохранения задания - ничего не сохраняется
+            raise ApiError('Ошибки в данных, ничего не сохранено', 422, errors)
+        return created_ids
+
+    try:
+        created_ids = writer.run(write)
+    except db.IntegrityError as e:
+        raise ApiError(f'Нарушено ограничение БД: {e}', 409)
+
+    cache.invalidate(name)
+    if name == 'users' and changes:
+        # Статус пользователя проверяется по кешу principal - старые строки сбрасываются
+        principals.invalidate(*(record_id for _, record_id, _ in changes))
+    return jsonify({'created': created_ids, 'updated': [record_id for _, record_id, _ in changes]})
@@ -1,159 +1,216 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, abort, g, render_template, request, redirect, url_for, flash, session, stream_with_context
 from datetime import datetime
-import sqlite3
 import os
 
+import click
+
+import api
+import archive
+import assets
+import conditional
+import db
+import maintenance
+import metrics
+import principal
+import ratelimit
+import reports
+import templating
+import writer
+from bulk import EXPORT_QUERIES, FORMATS, IMPORT_SPECS, detect_format, export_rows, import_records, iter_records
+from cache import cache
+from compression import pack_text, unpack_row, unpack_text
+from db import get_db
+from migrations import backfill_stats, backfill_summaries, index_search, migrate, rebuild_search, unindex_search
+from pagination import paginate
+from principal import principals
+from search import highlight, search_cases, search_protocols
+
 app = Flask(__name__)
+db.init_app(app)
+metrics.init_app(app)
+# Лимиты проверяются первыми: отклоненный запрос не обращается к БД
+ratelimit.init_app(app)
+assets.init_app(app)
+# Пользователь загружается до проверки ETag: разлогиненный не получит 304
+principal.init_app(app)
+conditional.init_app(app)
+maintenance.init_app(app)
 
 # Конфигурация из переменных окружения
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
-
-# Конфигурация БД
-DATABASE = os.environ.get('DATABASE_URL', 'gvsu.db')
-# Railway использует DATABASE_URL для PostgreSQL, но у нас SQLite
-# Если DATABASE_URL существует и это не SQLite, можно будет добавить поддержку PostgreSQL
-if DATABASE.startswith('postgres://') or DATABASE.startswith('postgresql://'):
-    # Для PostgreSQL нужна другая библиотека, пока используем SQLite
-    DATABASE = 'gvsu.db'
-
-def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Таблица новостей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS news (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            date TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица пользователей (регистрация)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            full_name TEXT NOT NULL,
-            username TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            experience TEXT,
-            education TEXT,
-            rank TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Добавить поле status если его нет (для существующих БД)
-    try:
-        cursor.execute('ALTER TABLE users ADD COLUMN status TEXT DEFAULT "pending"')
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
-    
-    # Таблица сотрудников
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS employees (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            full_name TEXT NOT NULL,
-            position TEXT NOT NULL,
-            department TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица дел
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            case_number TEXT,
-            assigned_to INTEGER,
-            status TEXT DEFAULT 'open',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (assigned_to) REFERENCES employees(id)
-        )
-    ''')
-    
-    # Таблица протоколов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS protocols (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            case_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            protocol_number TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (case_id) REFERENCES cases(id),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    ''')
-    
-    # Таблица админов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS admins (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL
-        )
-    ''')
-    
-    # Создать дефолтного админа, если его нет
-    cursor.execute('SELECT COUNT(*) FROM admins')
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('INSERT INTO admins (username, password) VALUES (?, ?)', 
-                      ('admin', 'admin123'))
-    
+app.add_template_filter(highlight)
+templating.init_app(app)
+app.register_blueprint(api.bp)
+
+# Допустимые значения фильтра по статусу в списках
+USER_STATUSES = ('pending', 'approved', 'rejected')
+CASE_STATUSES = ('open', 'in_progress', 'closed')
+
+# Массовые действия над заявками: действие -> новый статус (None - удаление)
+USER_BULK_ACTIONS = {'approve': 'approved', 'reject': 'rejected', 'delete': None}
+# Сколько id передавать в одном IN (...) - с запасом до лимита параметров SQLite
+BULK_CHUNK_SIZE = 500
+
+# Таблицы, доступные для массового импорта
+IMPORT_TABLES = (
+    ('employees', 'Сотрудники'),
+    ('cases', 'Дела'),
+    ('news', 'Новости'),
+    ('users', 'Пользователи'),
+    ('protocols', 'Протоколы'),
+)
+
+# Применение миграций схемы при старте (повторно не выполняются)
+migrate()
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Применить миграции схемы БД"""
+    applied = migrate()
+    print(f'Применены миграции: {applied}' if applied else 'Схема БД актуальна')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Собрать статические ресурсы с отпечатками и сжатыми вариантами"""
+    manifest = assets.build(app.static_folder)
+    for name, filename in manifest.items():
+        if not name.startswith('_'):
+            print(f'{name} -> {filename}')
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Перестроить полнотекстовые индексы по протоколам и делам"""
+    conn = db.connect()
+    rebuild_search(conn)
     conn.commit()
     conn.close()
-
-def get_db():
-    """Получить соединение с БД"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# Инициализация БД при старте
-init_db()
+    print('Поисковые индексы перестроены')
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Пересчитать счетчики дашборда и сводки отчетов по текущим данным"""
+    conn = db.connect()
+    db.begin_write(conn)
+    backfill_stats(conn)
+    backfill_summaries(conn)
+    conn.commit()
+    conn.close()
+    print('Счетчики и сводки пересчитаны')
+
+@app.cli.command('compress-protocols')
+def compress_protocols_command():
+    """Сжать тексты протоколов, записанные до включения сжатия"""
+    conn = db.connect()
+    packed = 0
+    last_id = 0
+    while True:
+        # Пачка - одна транзакция: запись других воркеров ждет недолго
+        db.begin_write(conn)
+        rows = conn.execute('SELECT id, content, updated_at FROM protocols WHERE id > ? ORDER BY id LIMIT 500',
+                            (last_id,)).fetchall()
+        if not rows:
+            conn.rollback()
+            break
+        changed = []
+        for row in rows:
+            value = pack_text(conn, unpack_text(row['content']))
+            if value != row['content']:
+                changed.append((value, row['id'], row['updated_at']))
+        # Текст не меняется, поэтому updated_at сохраняется: триггер ставит текущее
+        # время, если значение осталось прежним, - оно сбрасывается и возвращается
+        conn.executemany('UPDATE protocols SET content = ?, updated_at = NULL WHERE id = ?',
+                         [(value, protocol_id) for value, protocol_id, _ in changed])
+        conn.executemany('UPDATE protocols SET updated_at = ? WHERE id = ?',
+                         [(updated_at, protocol_id) for _, protocol_id, updated_at in changed])
+        conn.commit()
+        packed += len(changed)
+        last_id = rows[-1]['id']
+    conn.close()
+    print(f'Сжато протоколов: {packed}. Место в файле БД вернет обслуживание (flask --app app maintenance).')
+
+@app.cli.command('maintenance')
+@click.option('--enable-incremental', is_flag=True,
+              help='Включить инкрементальную очистку (полный VACUUM, запись на это время ждет)')
+def maintenance_command(enable_incremental):
+    """Обслуживание БД сейчас: сироты, статистика, очистка, контрольная точка WAL"""
+    if db.is_postgres_url(db.DATABASE):
+        raise click.ClickException('PostgreSQL обслуживается autovacuum')
+    # Та же блокировка, что у фонового обслуживания: если оно идет, команда ждет
+    report = maintenance.run_locked(enable=enable_incremental)
+    print(f'Готово за {report["seconds"]:.2f} с, освобождено байт: {report["reclaimed_bytes"]}')
+    print(f'Удалено протоколов без дела или автора: {report["orphans"]}, '
+          f'страниц очищено: {report["vacuumed_pages"]}, '
+          f'WAL: {report["checkpointed_pages"]}/{report["wal_pages"]}')
+    if not report['incremental']:
+        print('Инкрементальная очистка выключена: включите ее в удобное время '
+              'с --enable-incremental')
+
+@app.cli.command('archive')
+@click.option('--days', type=int, default=archive.ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Архивировать закрытые дела, не менявшиеся дольше стольких дней')
+@click.option('--batch-size', type=int, default=archive.ARCHIVE_BATCH_SIZE, show_default=True,
+              help='Дел в одной транзакции')
+def archive_command(days, batch_size):
+    """Перенести старые закрытые дела с протоколами в архивную БД"""
+    conn = db.connect()
+    try:
+        cases, protocols = archive.archive_closed_cases(conn, days, batch_size)
+    except archive.ArchiveUnsupported as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    print(f'В архив {archive.ARCHIVE_DATABASE} перенесено дел: {cases}, протоколов: {protocols}')
+
+@app.cli.command('backup')
+@click.argument('target')
+def backup_command(target):
+    """Онлайн-копия БД (и архива, если он есть) без остановки записи"""
+    if db.is_postgres_url(db.DATABASE):
+        raise click.ClickException('Для PostgreSQL используйте pg_dump или pg_basebackup')
+    copies = [(db.DATABASE, target)]
+    if os.path.exists(archive.ARCHIVE_DATABASE):
+        copies.append((archive.ARCHIVE_DATABASE, os.path.splitext(target)[0] + '-archive.db'))
+    for source, copy in copies:
+        try:
+            elapsed = archive.backup(source, copy)
+        except FileExistsError as e:
+            raise click.ClickException(str(e))
+        print(f'{source} -> {copy} ({elapsed:.1f} с)')
 
 @app.route('/')
 def index():
     """Главная страница"""
-    conn = get_db()
-    news = conn.execute('SELECT * FROM news ORDER BY date DESC LIMIT 5').fetchall()
-    conn.close()
+    news = cache.get('latest_news', lambda: get_db().execute(
+        'SELECT * FROM news ORDER BY date DESC LIMIT 5').fetchall(), tables=('news',))
     return render_template('base.html', news=news)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     """Регистрация пользователя"""
     if request.method == 'POST':
-        conn = get_db()
-        # Проверка существования пользователя
-        existing_user = conn.execute('SELECT * FROM users WHERE username = ?', 
-                                    (request.form['username'],)).fetchone()
-        if existing_user:
-            flash('Пользователь с таким логином уже существует', 'error')
-            return render_template('register.html')
-        
-        # Создание пользователя со статусом pending
-        conn.execute('''
-            INSERT INTO users (full_name, username, password, experience, education, rank, status)
-            VALUES (?, ?, ?, ?, ?, ?, 'pending')
-        ''', (
+        values = (
             request.form['full_name'],
             request.form['username'],
             request.form['password'],
             request.form.get('experience', ''),
             request.form.get('education', ''),
             request.form.get('rank', '')
-        ))
-        conn.commit()
-        conn.close()
+        )
+        
+        def create_user(conn):
+            # Проверка существования и вставка в одной транзакции
+            if conn.execute('SELECT 1 FROM users WHERE username = ?', (values[1],)).fetchone():
+                return False
+            # Создание пользователя со статусом pending
+            conn.execute('''
+                INSERT INTO users (full_name, username, password, experience, education, rank, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending')
+            ''', values)
+            return True
+        
+        if not writer.run(create_user):
+            flash('Пользователь с таким логином уже существует', 'error')
+            return render_template('register.html')
         flash('Регистрация успешна! Ваша заявка отправлена администратору на одобрение. Вы получите доступ после проверки.', 'success')
         return redirect(url_for('index'))
     
@@ -169,7 +226,6 @@ def user_login():
         conn = get_db()
         user = conn.execute('SELECT * FROM users WHERE username = ? AND password = ?', 
                            (username, password)).fetchone()
-        conn.close()
         
         if user:
             if user['status'] == 'pending':
@@ -177,6 +233,7 @@ def user_login():
             elif user['status'] == 'rejected':
                 flash('Ваш аккаунт был отклонен администратором.', 'error')
             elif user['status'] == 'approved':
+                principals.invalidate(user['id'])
                 session['user_id'] = user['id']
                 session['username'] = user['username']
                 flash('Вы успешно вошли в систему', 'success')
@@ -199,30 +256,27 @@ def user_logout():
 @app.route('/user/dashboard')
 def user_dashboard():
     """Дэшборд пользователя"""
-    if not session.get('user_id'):
+    if g.user is None:
         return redirect(url_for('user_login'))
     
+    # Строка пользователя уже загружена (см. principal.py)
     conn = get_db()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    cases = conn.execute('''
+    cases = paginate(conn, '''
         SELECT c.*, e.full_name as assigned_employee 
         FROM cases c 
-        LEFT JOIN employees e ON c.assigned_to = e.id 
-        ORDER BY c.created_at DESC
-    ''').fetchall()
+        LEFT JOIN employees e ON c.assigned_to = e.id
+    ''', (('c.created_at', 'created_at'), ('c.id', 'id')), prefix='cases_')
     
-    # Получить протоколы текущего пользователя
-    protocols = conn.execute('''
-        SELECT p.*, c.title as case_title, c.case_number as case_number
+    # Получить протоколы текущего пользователя (без текста - он нужен только при просмотре)
+    protocols = paginate(conn, '''
+        SELECT p.id, p.case_id, p.title, p.protocol_number, p.created_at,
+               c.title as case_title, c.case_number as case_number
         FROM protocols p
         JOIN cases c ON p.case_id = c.id
-        WHERE p.user_id = ?
-        ORDER BY p.created_at DESC
-    ''', (session['user_id'],)).fetchall()
+    ''', (('p.created_at', 'created_at'), ('p.id', 'id')),
+        where=('p.user_id = ?',), params=(g.user['id'],), prefix='protocols_')
     
-    conn.close()
-    
-    return render_template('user/dashboard.html', user=user, cases=cases, protocols=protocols)
+    return render_template('user/dashboard.html', user=g.user, cases=cases, protocols=protocols)
 
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
@@ -234,7 +288,6 @@ def admin_login():
         conn = get_db()
         admin = conn.execute('SELECT * FROM admins WHERE username = ? AND password = ?', 
                             (username, password)).fetchone()
-        conn.close()
         
         if admin:
             session['admin'] = True
@@ -258,22 +311,17 @@ def admin_dashboard():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
+    # Счетчики поддерживаются триггерами (см. migrations.add_stats_counters)
     conn = get_db()
-    news_count = conn.execute('SELECT COUNT(*) FROM news').fetchone()[0]
-    users_count = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-    pending_users_count = conn.execute('SELECT COUNT(*) FROM users WHERE status = "pending"').fetchone()[0]
-    employees_count = conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
-    cases_count = conn.execute('SELECT COUNT(*) FROM cases').fetchone()[0]
-    protocols_count = conn.execute('SELECT COUNT(*) FROM protocols').fetchone()[0]
-    conn.close()
+    stats = dict(conn.execute('SELECT key, value FROM stats').fetchall())
     
     return render_template('admin/dashboard.html', 
-                         news_count=news_count,
-                         users_count=users_count,
-                         pending_users_count=pending_users_count,
-                         employees_count=employees_count,
-                         cases_count=cases_count,
-                         protocols_count=protocols_count)
+                         news_count=stats.get('news', 0),
+                         users_count=stats.get('users', 0),
+                         pending_users_count=stats.get('users:pending', 0),
+                         employees_count=stats.get('employees', 0),
+                         cases_count=stats.get('cases', 0),
+                         protocols_count=stats.get('protocols', 0))
 
 @app.route('/admin/news', methods=['GET', 'POST'])
 def admin_news():
@@ -282,8 +330,7 @@ def admin_news():
         return redirect(url_for('admin_login'))
     
     if request.method == 'POST':
-        conn = get_db()
-        conn.execute('''
+        writer.execute('''
             INSERT INTO news (title, content, date)
             VALUES (?, ?, ?)
         ''', (
@@ -291,14 +338,12 @@ def admin_news():
             request.form['content'],
             request.form['date']
         ))
-        conn.commit()
-        conn.close()
+        cache.invalidate('news')
         flash('Новость успешно добавлена', 'success')
         return redirect(url_for('admin_news'))
     
     conn = get_db()
-    news = conn.execute('SELECT * FROM news ORDER BY date DESC').fetchall()
-    conn.close()
+    news = paginate(conn, 'SELECT * FROM news', (('date', 'date'), ('id', 'id')))
     return render_template('admin/news.html', news=news)
 
 @app.route('/admin/news/delete/<int:news_id>')
@@ -307,10 +352,8 @@ def delete_news(news_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('DELETE FROM news WHERE id = ?', (news_id,))
-    conn.commit()
-    conn.close()
+    writer.execute('DELETE FROM news WHERE id = ?', (news_id,))
+    cache.invalidate('news')
     flash('Новость удалена', 'success')
     return redirect(url_for('admin_news'))
 
@@ -321,8 +364,7 @@ def admin_employees():
         return redirect(url_for('admin_login'))
     
     if request.method == 'POST':
-        conn = get_db()
-        conn.execute('''
+        writer.execute('''
             INSERT INTO employees (full_name, position, department)
             VALUES (?, ?, ?)
         ''', (
@@ -330,14 +372,12 @@ def admin_employees():
             request.form['position'],
             request.form.get('department', '')
         ))
-        conn.commit()
-        conn.close()
+        cache.invalidate('employees')
         flash('Сотрудник добавлен', 'success')
         return redirect(url_for('admin_employees'))
     
     conn = get_db()
-    employees = conn.execute('SELECT * FROM employees ORDER BY created_at DESC').fetchall()
-    conn.close()
+    employees = paginate(conn, 'SELECT * FROM employees', (('created_at', 'created_at'), ('id', 'id')))
     return render_template('admin/employees.html', employees=employees)
 
 @app.route('/admin/employees/<int:emp_id>/delete')
@@ -346,10 +386,8 @@ def delete_employee(emp_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('DELETE FROM employees WHERE id = ?', (emp_id,))
-    conn.commit()
-    conn.close()
+    writer.execute('DELETE FROM employees WHERE id = ?', (emp_id,))
+    cache.invalidate('employees')
     flash('Сотрудник удален', 'success')
     return redirect(url_for('admin_employees'))
 
@@ -360,8 +398,7 @@ def admin_cases():
         return redirect(url_for('admin_login'))
     
     if request.method == 'POST':
-        conn = get_db()
-        conn.execute('''
+        writer.execute('''
             INSERT INTO cases (title, description, case_number, assigned_to, status)
             VALUES (?, ?, ?, ?, ?)
         ''', (
@@ -371,22 +408,24 @@ def admin_cases():
             request.form.get('assigned_to') if request.form.get('assigned_to') else None,
             request.form.get('status', 'open')
         ))
-        conn.commit()
-        conn.close()
         flash('Дело успешно создано', 'success')
         return redirect(url_for('admin_cases'))
     
+    status = request.args.get('status')
+    if status not in CASE_STATUSES:
+        status = None
+    
     conn = get_db()
-    cases = conn.execute('''
+    cases = paginate(conn, '''
         SELECT c.*, e.full_name as assigned_employee 
         FROM cases c 
-        LEFT JOIN employees e ON c.assigned_to = e.id 
-        ORDER BY c.created_at DESC
-    ''').fetchall()
-    employees = conn.execute('SELECT * FROM employees ORDER BY full_name').fetchall()
-    conn.close()
+        LEFT JOIN employees e ON c.assigned_to = e.id
+    ''', (('c.created_at', 'created_at'), ('c.id', 'id')),
+        where=('c.status = ?',) if status else (), params=(status,) if status else ())
+    employees = cache.get('employees_by_name', lambda: conn.execute(
+        'SELECT * FROM employees ORDER BY full_name').fetchall(), tables=('employees',))
     
-    return render_template('admin/cases.html', cases=cases, employees=employees)
+    return render_template('admin/cases.html', cases=cases, employees=employees, status=status)
 
 @app.route('/admin/cases/<int:case_id>/delete')
 def delete_case(case_id):
@@ -394,10 +433,7 @@ def delete_case(case_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('DELETE FROM cases WHERE id = ?', (case_id,))
-    conn.commit()
-    conn.close()
+    writer.execute('DELETE FROM cases WHERE id = ?', (case_id,))
     flash('Дело удалено', 'success')
     return redirect(url_for('admin_cases'))
 
@@ -407,10 +443,74 @@ def admin_users():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
+    status = request.args.get('status')
+    if status not in USER_STATUSES:
+        status = None
+    
     conn = get_db()
-    users = conn.execute('SELECT * FROM users ORDER BY created_at DESC').fetchall()
-    conn.close()
-    return render_template('admin/users.html', users=users)
+    users = paginate(conn, 'SELECT * FROM users', (('created_at', 'created_at'), ('id', 'id')),
+                     where=('status = ?',) if status else (), params=(status,) if status else ())
+    return render_template('admin/users.html', users=users, status=status)
+
+@app.route('/admin/users/pending')
+def admin_pending_users():
+    """Очередь заявок на регистрацию (сначала старые)"""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    
+    # Очередь читается по индексу idx_users_status_created_at
+    conn = get_db()
+    users = paginate(conn, '''
+        SELECT id, full_name, username, rank, experience, education, created_at FROM users
+    ''', (('created_at', 'created_at'), ('id', 'id')),
+        where=('status = ?',), params=('pending',), descending=False)
+    # Граница для действия "все заявки": поступившие позже показа страницы не затрагиваются
+    until_id = conn.execute('SELECT MAX(id) FROM users').fetchone()[0] or 0
+    return render_template('admin/pending_users.html', users=users, until_id=until_id)
+
+def _apply_user_action(conn, status, where, params):
+    """Изменить статус (или удалить при status=None) пользователей по условию"""
+    if status is None:
+        return conn.execute(f'DELETE FROM users WHERE {where}', params).rowcount
+    return conn.execute(f'UPDATE users SET status = ? WHERE {where}', (status, *params)).rowcount
+
+@app.route('/admin/users/bulk', methods=['POST'])
+def bulk_users():
+    """Одобрение, отклонение или удаление выбранных заявок одной транзакцией"""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    
+    action = request.form.get('action')
+    if action not in USER_BULK_ACTIONS:
+        abort(400)
+    status = USER_BULK_ACTIONS[action]
+    
+    if request.form.get('scope') == 'all':
+        until_id = request.form.get('until_id', type=int)
+        if until_id is None:
+            abort(400)
+        count = writer.run(lambda conn: _apply_user_action(
+            conn, status, 'status = ? AND id <= ?', ('pending', until_id)))
+        principals.invalidate()
+    else:
+        ids = sorted(set(request.form.getlist('ids', type=int)))
+        if not ids:
+            flash('Не выбрано ни одной заявки', 'error')
+            return redirect(url_for('admin_pending_users'))
+        
+        def apply(conn):
+            count = 0
+            for start in range(0, len(ids), BULK_CHUNK_SIZE):
+                chunk = ids[start:start + BULK_CHUNK_SIZE]
+                count += _apply_user_action(conn, status, f'id IN ({", ".join("?" * len(chunk))})', chunk)
+            return count
+        
+        count = writer.run(apply)
+        principals.invalidate(*ids)
+    
+    messages = {'approve': 'Одобрено', 'reject': 'Отклонено', 'delete': 'Удалено'}
+    flash(f'{messages[action]} пользователей: {count}', 'success')
+    return redirect(url_for('admin_pending_users'))
 
 @app.route('/admin/users/<int:user_id>/approve', methods=['POST'])
 def approve_user(user_id):
@@ -418,10 +518,8 @@ def approve_user(user_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('UPDATE users SET status = ? WHERE id = ?', ('approved', user_id))
-    conn.commit()
-    conn.close()
+    writer.execute('UPDATE users SET status = ? WHERE id = ?', ('approved', user_id))
+    principals.invalidate(user_id)
     flash('Пользователь одобрен', 'success')
     return redirect(url_for('admin_users'))
 
@@ -431,10 +529,8 @@ def reject_user(user_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('UPDATE users SET status = ? WHERE id = ?', ('rejected', user_id))
-    conn.commit()
-    conn.close()
+    writer.execute('UPDATE users SET status = ? WHERE id = ?', ('rejected', user_id))
+    principals.invalidate(user_id)
     flash('Пользователь отклонен', 'success')
     return redirect(url_for('admin_users'))
 
@@ -447,7 +543,7 @@ def edit_user(user_id):
     conn = get_db()
     
     if request.method == 'POST':
-        conn.execute('''
+        writer.execute('''
             UPDATE users 
             SET full_name = ?, username = ?, password = ?, experience = ?, education = ?, rank = ?, status = ?
             WHERE id = ?
@@ -461,13 +557,11 @@ def edit_user(user_id):
             request.form['status'],
             user_id
         ))
-        conn.commit()
-        conn.close()
+        principals.invalidate(user_id)
         flash('Пользователь обновлен', 'success')
         return redirect(url_for('admin_users'))
     
     user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
     
     if not user:
         flash('Пользователь не найден', 'error')
@@ -481,47 +575,51 @@ def delete_user(user_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    writer.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    principals.invalidate(user_id)
     flash('Пользователь удален', 'success')
     return redirect(url_for('admin_users'))
 
 @app.route('/user/protocols/create', methods=['GET', 'POST'])
 def create_protocol():
     """Создание протокола к делу"""
-    if not session.get('user_id'):
+    if g.user is None:
         return redirect(url_for('user_login'))
     
-    conn = get_db()
-    
     if request.method == 'POST':
-        conn.execute('''
-            INSERT INTO protocols (case_id, user_id, title, content, protocol_number)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            request.form['case_id'],
-            session['user_id'],
-            request.form['title'],
-            request.form['content'],
-            request.form.get('protocol_number', '')
-        ))
-        conn.commit()
-        conn.close()
+        case_id = request.form.get('case_id', type=int)
+        user_id = g.user['id']
+        title = request.form['title']
+        content = request.form['content']
+        protocol_number = request.form.get('protocol_number', '')
+        def create(conn):
+            # Дело проверяется в той же транзакции: протокол без дела не появится
+            if not conn.execute('SELECT 1 FROM cases WHERE id = ?', (case_id,)).fetchone():
+                return False
+            # Текст сжимается под соединение писателя (в PostgreSQL хранится как есть)
+            protocol_id = db.insert(conn, '''
+                INSERT INTO protocols (case_id, user_id, title, content, protocol_number)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (case_id, user_id, title, pack_text(conn, content), protocol_number))
+            index_search(conn, 'protocols', 'id = ?', (protocol_id,))
+            return True
+        
+        if case_id is None or not writer.run(create):
+            flash('Дело не найдено', 'error')
+            return redirect(url_for('create_protocol'))
         flash('Протокол успешно создан', 'success')
         return redirect(url_for('user_dashboard'))
     
     # Получить список дел для выбора
+    conn = get_db()
     cases = conn.execute('SELECT * FROM cases ORDER BY created_at DESC').fetchall()
-    conn.close()
     
     return render_template('user/create_protocol.html', cases=cases)
 
 @app.route('/user/protocols/<int:protocol_id>')
 def view_protocol(protocol_id):
     """Просмотр протокола"""
-    if not session.get('user_id'):
+    if g.user is None:
         return redirect(url_for('user_login'))
     
     conn = get_db()
@@ -531,34 +629,38 @@ def view_protocol(protocol_id):
         JOIN cases c ON p.case_id = c.id
         JOIN users u ON p.user_id = u.id
         WHERE p.id = ? AND p.user_id = ?
-    ''', (protocol_id, session['user_id'])).fetchone()
-    conn.close()
+    ''', (protocol_id, g.user['id'])).fetchone()
+    if not protocol:
+        # Протокол мог быть перенесен в архив вместе с закрытым делом
+        protocol = archive.find_protocol(conn, protocol_id, user_id=g.user['id'])
     
     if not protocol:
         flash('Протокол не найден', 'error')
         return redirect(url_for('user_dashboard'))
     
-    return render_template('user/view_protocol.html', protocol=protocol)
+    return render_template('user/view_protocol.html', protocol=unpack_row('protocols', protocol))
+
+def _delete_protocols(conn, where, params):
+    """Удалить протоколы по условию вместе с записями поиска; вернуть число удаленных"""
+    unindex_search(conn, 'protocols', where, params)
+    return conn.execute(f'DELETE FROM protocols WHERE {where}', params).rowcount
 
 @app.route('/user/protocols/<int:protocol_id>/delete', methods=['POST'])
 def delete_protocol(protocol_id):
     """Удаление протокола"""
-    if not session.get('user_id'):
+    if g.user is None:
         return redirect(url_for('user_login'))
     
-    conn = get_db()
-    # Проверяем, что протокол принадлежит текущему пользователю
-    protocol = conn.execute('SELECT * FROM protocols WHERE id = ? AND user_id = ?', 
-                           (protocol_id, session['user_id'])).fetchone()
+    # Удаляется, только если протокол принадлежит текущему пользователю
+    user_id = g.user['id']
+    deleted = writer.run(lambda conn: _delete_protocols(conn, 'id = ? AND user_id = ?',
+                                                        (protocol_id, user_id)))
     
-    if protocol:
-        conn.execute('DELETE FROM protocols WHERE id = ?', (protocol_id,))
-        conn.commit()
+    if deleted:
         flash('Протокол удален', 'success')
     else:
         flash('Протокол не найден или у вас нет прав на его удаление', 'error')
     
-    conn.close()
     return redirect(url_for('user_dashboard'))
 
 @app.route('/admin/protocols')
@@ -567,16 +669,16 @@ def admin_protocols():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
+    # Только метаданные: текст протокола читается и распаковывается при просмотре
     conn = get_db()
-    protocols = conn.execute('''
-        SELECT p.*, c.title as case_title, c.case_number as case_number, 
+    protocols = paginate(conn, '''
+        SELECT p.id, p.title, p.protocol_number, p.created_at,
+               c.title as case_title, c.case_number as case_number, 
                u.full_name as user_name, u.username as user_username
         FROM protocols p
         JOIN cases c ON p.case_id = c.id
         JOIN users u ON p.user_id = u.id
-        ORDER BY p.created_at DESC
-    ''').fetchall()
-    conn.close()
+    ''', (('p.created_at', 'created_at'), ('p.id', 'id')))
     
     return render_template('admin/protocols.html', protocols=protocols)
 
@@ -595,13 +697,14 @@ def admin_view_protocol(protocol_id):
         JOIN users u ON p.user_id = u.id
         WHERE p.id = ?
     ''', (protocol_id,)).fetchone()
-    conn.close()
+    if not protocol:
+        protocol = archive.find_protocol(conn, protocol_id)
     
     if not protocol:
         flash('Протокол не найден', 'error')
         return redirect(url_for('admin_protocols'))
     
-    return render_template('admin/view_protocol.html', protocol=protocol)
+    return render_template('admin/view_protocol.html', protocol=unpack_row('protocols', protocol))
 
 @app.route('/admin/protocols/<int:protocol_id>/delete', methods=['POST'])
 def admin_delete_protocol(protocol_id):
@@ -609,14 +712,103 @@ def admin_delete_protocol(protocol_id):
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db()
-    conn.execute('DELETE FROM protocols WHERE id = ?', (protocol_id,))
-    conn.commit()
-    conn.close()
+    writer.run(lambda conn: _delete_protocols(conn, 'id = ?', (protocol_id,)))
     flash('Протокол удален', 'success')
     return redirect(url_for('admin_protocols'))
 
+@app.route('/admin/reports')
+def admin_reports():
+    """Отчеты по делам и протоколам (из сводок, см. reports.py)"""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    
+    conn = get_db()
+    return render_template('admin/reports.html',
+                           cases_by_status=reports.summary(conn, 'cases_by_status'),
+                           workload=reports.case_workload(conn),
+                           top_cases=reports.top_cases(conn),
+                           top_users=reports.top_users(conn),
+                           by_day=reports.protocols_by_day(conn))
+
+@app.route('/admin/search')
+def admin_search():
+    """Поиск по протоколам и делам (админ)"""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    
+    q = request.args.get('q', '').strip()
+    scope = 'cases' if request.args.get('scope') == 'cases' else 'protocols'
+    page = request.args.get('page', 1, type=int)
+    
+    conn = get_db()
+    if scope == 'cases':
+        results = search_cases(conn, q, page=page)
+    else:
+        results = search_protocols(conn, q, page=page)
+    
+    return render_template('admin/search.html', q=q, scope=scope, results=results)
+
+@app.route('/user/search')
+def user_search():
+    """Поиск по своим протоколам и делам"""
+    if g.user is None:
+        return redirect(url_for('user_login'))
+    
+    q = request.args.get('q', '').strip()
+    scope = 'cases' if request.args.get('scope') == 'cases' else 'protocols'
+    page = request.args.get('page', 1, type=int)
+    
+    conn = get_db()
+    if scope == 'cases':
+        results = search_cases(conn, q, page=page)
+    else:
+        # Пользователь ищет только среди своих протоколов, как в view_protocol
+        results = search_protocols(conn, q, user_id=g.user['id'], page=page)
+    
+    return render_template('user/search.html', q=q, scope=scope, results=results)
+
+@app.route('/admin/import', methods=['GET', 'POST'])
+def admin_import():
+    """Массовый импорт записей из CSV или JSON Lines"""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    
+    result = None
+    table = request.form.get('table')
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if table not in IMPORT_SPECS or not upload or not upload.filename:
+            flash('Выберите, что импортировать, и файл', 'error')
+            return redirect(url_for('admin_import'))
+        
+        fmt = detect_format(upload.filename)
+        conn = get_db()
+        result = import_records(conn, table, iter_records(upload.stream, fmt))
+        cache.invalidate(table)
+        if result.error_count:
+            flash(f'Импортировано записей: {result.inserted}, с ошибками: {result.error_count}', 'error')
+        else:
+            flash(f'Импортировано записей: {result.inserted}', 'success')
+    
+    return render_template('admin/import.html', result=result, table=table,
+                           tables=IMPORT_TABLES, columns=IMPORT_SPECS)
+
+@app.route('/admin/export/<table>.<fmt>')
+def admin_export(table, fmt):
+    """Потоковый экспорт протоколов или дел"""
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    if table not in EXPORT_QUERIES or fmt not in FORMATS:
+        abort(404)
+    
+    conn = get_db()
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_rows(conn, table, fmt)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'})
+
 if __name__ == '__main__':
+    metrics.clear_dir()
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,166 @@
+"""Архив закрытых дел и их протоколов в отдельном файле SQLite.
+
+Закрытые дела, не менявшиеся дольше ARCHIVE_AFTER_DAYS дней, переносятся
+вместе с протоколами из основной БД в ARCHIVE_DATABASE пачками по
+ARCHIVE_BATCH_SIZE дел, каждая пачка - своя транзакция. Основные таблицы
+остаются небольшими, списки и сортировки по ним не тратят время на старые
+записи. Архив подключается к соединению (ATTACH) только когда нужен:
+при переносе и при просмотре протокола, которого нет в основной БД.
+
+Идентификаторы не переиспользуются (AUTOINCREMENT), поэтому протокол
+открывается по тому же адресу и после переноса. Запись в архив идет раньше
+удаления из основной БД, а повторная вставка заменяет строку: если перенос
+прервется, записи не потеряются, и повторный запуск его завершит.
+
+Счетчики дашборда, сводки отчетов и полнотекстовый поиск учитывают только
+оперативные (не архивные) данные.
+"""
+import os
+import sqlite3
+import time
+
+import db
+from migrations import unindex_search
+
+ARCHIVE_DATABASE = os.environ.get('ARCHIVE_DATABASE') or os.path.splitext(db.DATABASE)[0] + '-archive.db'
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 100))
+
+CASE_COLUMNS = ('id', 'title', 'description', 'case_number', 'assigned_to', 'status',
+                'created_at', 'updated_at')
+PROTOCOL_COLUMNS = ('id', 'case_id', 'user_id', 'title', 'content', 'protocol_number',
+                    'created_at', 'updated_at')
+
+
+class ArchiveUnsupported(RuntimeError):
+    """Архив поддерживается только для SQLite"""
+
+
+def _create_schema(conn):
+    conn.execute('PRAGMA archive.journal_mode = WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.cases (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            case_number TEXT,
+            assigned_to INTEGER,
+            status TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.protocols (
+            id INTEGER PRIMARY KEY,
+            case_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            protocol_number TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_protocols_case_id ON protocols (case_id)')
+
+
+def attach(conn, create=False):
+    """Подключить архив к соединению; False, если архива нет (или это не SQLite).
+
+    ATTACH нельзя выполнить внутри транзакции - вызывать до начала записи.
+    """
+    if db.is_postgres(conn):
+        if create:
+            raise ArchiveUnsupported('Архив поддерживается только для SQLite')
+        return False
+    if any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list')):
+        return True
+    if not create and not os.path.exists(ARCHIVE_DATABASE):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DATABASE,))
+    if create:
+        _create_schema(conn)
+    return True
+
+
+def find_protocol(conn, protocol_id, user_id=None):
+    """Протокол из архива (с делом и автором), как в view_protocol; None, если нет"""
+    if not attach(conn):
+        return None
+    sql = '''
+        SELECT p.*, c.title as case_title, c.case_number as case_number,
+               u.full_name as user_name, u.username as user_username
+        FROM archive.protocols p
+        JOIN archive.cases c ON p.case_id = c.id
+        JOIN users u ON p.user_id = u.id
+        WHERE p.id = ?
+    '''
+    params = [protocol_id]
+    if user_id is not None:
+        sql += ' AND p.user_id = ?'
+        params.append(user_id)
+    return conn.execute(sql, params).fetchone()
+
+
+def _move_batch(conn, cutoff, batch_size):
+    """Перенести одну пачку дел с протоколами; вернуть (дел, протоколов)"""
+    db.begin_write(conn)
+    try:
+        ids = [row[0] for row in conn.execute('''
+            SELECT id FROM main.cases
+            WHERE status = 'closed' AND updated_at < ?
+            ORDER BY id LIMIT ?
+        ''', (cutoff, batch_size))]
+        if not ids:
+            conn.rollback()
+            return 0, 0
+        placeholders = ', '.join('?' * len(ids))
+        case_cols = ', '.join(CASE_COLUMNS)
+        protocol_cols = ', '.join(PROTOCOL_COLUMNS)
+        conn.execute(f'INSERT OR REPLACE INTO archive.cases ({case_cols}) '
+                     f'SELECT {case_cols} FROM main.cases WHERE id IN ({placeholders})', ids)
+        conn.execute(f'INSERT OR REPLACE INTO archive.protocols ({protocol_cols}) '
+                     f'SELECT {protocol_cols} FROM main.protocols WHERE case_id IN ({placeholders})', ids)
+        unindex_search(conn, 'protocols', f'case_id IN ({placeholders})', ids)
+        protocols = conn.execute(f'DELETE FROM main.protocols WHERE case_id IN ({placeholders})', ids).rowcount
+        cases = conn.execute(f'DELETE FROM main.cases WHERE id IN ({placeholders})', ids).rowcount
+        conn.commit()
+        return cases, protocols
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def archive_closed_cases(conn, days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Перенести в архив закрытые дела старше days дней; вернуть (дел, протоколов)"""
+    attach(conn, create=True)
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{days:d} days',)).fetchone()[0]
+    total_cases = total_protocols = 0
+    while True:
+        cases, protocols = _move_batch(conn, cutoff, batch_size)
+        if not cases:
+            return total_cases, total_protocols
+        total_cases += cases
+        total_protocols += protocols
+
+
+def backup(source, target):
+    """Онлайн-копия файла БД source в новый файл target (VACUUM INTO).
+
+    Копия снимается в одной читающей транзакции: в режиме WAL запись в БД
+    при этом продолжается, а копия согласована на момент начала. В отличие
+    от backup API, копирование не начинается заново после каждой записи,
+    поэтому завершается и под постоянной нагрузкой.
+    """
+    if os.path.exists(target):
+        raise FileExistsError(f'{target} уже существует')
+    src = sqlite3.connect(source, timeout=db.SQLITE_TIMEOUT)
+    try:
+        started = time.perf_counter()
+        src.execute('VACUUM INTO ?', (target,))
+        return time.perf_counter() - started
+    finally:
+        src.close()
@@ -0,0 +1,170 @@
+"""Статические ресурсы с отпечатком содержимого.
+
+Исходники из static/ (общая таблица стилей, логотип) копируются в static/dist
+под именем с хешем содержимого, рядом кладутся сжатые (gzip, brotli) и
+графические (WebP, уменьшенные) варианты. Такие файлы никогда не меняются,
+поэтому отдаются с Cache-Control: immutable и кешируются браузером навсегда;
+новая версия получает новое имя. Соответствие имен хранится в manifest.json.
+
+Brotli и Pillow необязательны: без них соответствующие варианты не создаются.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Исходные файлы относительно static/
+SOURCES = ('css/main.css', 'logo .png')
+# Типы, для которых имеет смысл предварительное сжатие
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json')
+# Высота логотипа в шапке (px) - для уменьшенного варианта
+LOGO_HEIGHT = 60
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_manifest = {}
+
+
+def _write(path, data):
+    """Атомарно записать файл (несколько воркеров могут собирать одновременно)"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _fingerprint(dist, name, data):
+    """Записать data под именем с хешем и сжатые варианты; вернуть имя файла"""
+    stem, ext = os.path.splitext(name)
+    stem = stem.strip().replace(' ', '-').replace('/', '-')
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    filename = f'{stem}.{digest}{ext}'
+    path = os.path.join(dist, filename)
+    if not os.path.exists(path):
+        _write(path, data)
+        if ext in COMPRESSIBLE:
+            _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(path + '.br', brotli.compress(data, quality=11))
+    return filename
+
+
+def _image_variants(source):
+    """Варианты изображения: оптимизированный PNG, WebP и уменьшенные копии"""
+    if Image is None:
+        return {}
+
+    def encode(image, fmt):
+        buf = io.BytesIO()
+        if fmt == 'WEBP':
+            image.save(buf, fmt, quality=90, method=6)
+        else:
+            image.save(buf, fmt, optimize=True)
+        return buf.getvalue()
+
+    with Image.open(source) as image:
+        image.load()
+        variants = {'': ('.png', encode(image, 'PNG')), ':webp': ('.webp', encode(image, 'WEBP'))}
+        if image.height > LOGO_HEIGHT:
+            width = round(image.width * LOGO_HEIGHT / image.height)
+            small = image.resize((width, LOGO_HEIGHT), Image.LANCZOS)
+            variants[':1x'] = ('.png', encode(small, 'PNG'))
+            variants[':1x.webp'] = ('.webp', encode(small, 'WEBP'))
+    return variants
+
+
+def build(static_folder):
+    """Собрать static/dist и manifest.json; вернуть манифест"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    for name in SOURCES:
+        source = os.path.join(static_folder, name)
+        with open(source, 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        if ext == '.png':
+            variants = _image_variants(source) or {'': (ext, data)}
+            for suffix, (variant_ext, payload) in variants.items():
+                # Оптимизация не должна увеличивать файл
+                if suffix == '' and len(payload) > len(data):
+                    payload = data
+                manifest[name + suffix] = _fingerprint(dist, stem + variant_ext, payload)
+        else:
+            manifest[name] = _fingerprint(dist, name, data)
+    manifest['_sources'] = _source_stamp(static_folder)
+    _write(os.path.join(dist, MANIFEST),
+           json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    return manifest
+
+
+def _source_stamp(static_folder):
+    stamp = {}
+    for name in SOURCES:
+        st = os.stat(os.path.join(static_folder, name))
+        stamp[name] = [st.st_size, int(st.st_mtime)]
+    return stamp
+
+
+def load(static_folder):
+    """Прочитать манифест; пересобрать, если исходники изменились"""
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = None
+    if manifest is None or manifest.get('_sources') != _source_stamp(static_folder):
+        manifest = build(static_folder)
+    return manifest
+
+
+def asset_url(name):
+    """URL ресурса с отпечатком; без манифеста - обычный URL из static/"""
+    filename = _manifest.get(name)
+    if filename is None:
+        return url_for('static', filename=name.split(':')[0])
+    return url_for('asset', filename=filename)
+
+
+def serve_asset(filename):
+    """Отдать неизменяемый ресурс, по возможности в сжатом виде"""
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    served, encoding = filename, None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[name] and os.path.exists(os.path.join(dist, filename + suffix)):
+            served, encoding = filename + suffix, name
+            break
+
+    response = send_from_directory(dist, served, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """Собрать ресурсы (если нужно) и подключить их раздачу к приложению"""
+    _manifest.clear()
+    _manifest.update(load(app.static_folder))
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
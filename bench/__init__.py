@@ -0,0 +1,8 @@
+"""Нагрузочные тесты и бенчмарки приложения.
+
+    python -m bench.seed --db bench.db            # синтетические данные
+    python -m bench.run --db bench.db --out bench/results.json
+    python -m bench.run --db bench.db --baseline bench/baseline.json
+
+См. README, раздел "Бенчмарки".
+"""
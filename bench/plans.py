@@ -0,0 +1,190 @@
+"""Проверка планов SQL-запросов всех маршрутов.
+
+Каждый маршрут из bench.run.ROUTES вызывается один раз через тестовый
+клиент Flask на копии заполненной БД (bench.seed). Все SQL-запросы, которые
+он выполнил (включая задания писателя - FlaskDriver трассирует и его
+соединение), записываются и прогоняются через EXPLAIN QUERY PLAN. Проблемой
+считается:
+
+  - полный просмотр таблицы без индекса (SCAN t) на таблице от --min-rows
+    строк;
+  - сортировка или группировка во временном B-дереве (USE TEMP B-TREE)
+    в запросе к такой таблице.
+
+Печатается отчет по маршрутам: запросы и их планы, проблемы помечены
+знаком «!». Если есть проблемы, не перечисленные в ALLOWED, процесс
+завершается с кодом 1 - так регрессии планов видны до деплоя:
+
+    python -m bench.seed --db bench.db --scale 0.01
+    python -m bench.plans --db bench.db
+
+Запросы трассируются уже с подставленными параметрами, поэтому план
+строится для тех значений, с которыми маршрут реально работал.
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.run import ROUTES, Context, FlaskDriver  # noqa: E402
+
+# Допустимые проблемы: (endpoint, проблема) -> почему это нормально
+ALLOWED = {
+    ('admin_export', 'SCAN cases'): 'экспорт читает таблицу целиком, потоком',
+    ('admin_export', 'SCAN protocols'): 'экспорт читает таблицу целиком, потоком',
+}
+
+# Операторы, для которых строится план
+EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+([\w.]+)(?:\s+(?:AS\s+)?(\w+))?', re.I)
+_NOT_ALIAS = {'WHERE', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'ON', 'ORDER', 'GROUP', 'LIMIT',
+              'USING', 'SET', 'VALUES', 'SELECT', 'DEFAULT', 'AND', 'OR', 'NATURAL'}
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SCAN = re.compile(r'^SCAN (\S+)$')
+_SEARCH_OR_SCAN = re.compile(r'^(?:SCAN|SEARCH) (\S+)')
+
+
+class Recorder(FlaskDriver):
+    """Тестовый клиент, который запоминает SQL-запросы каждого маршрута"""
+
+    def __init__(self, database):
+        super().__init__(database)
+        self.statements = []
+
+    def _trace(self, statement):
+        super()._trace(statement)
+        if statement.startswith('--') or "'main'." in statement:
+            return
+        if statement.lstrip().split(None, 1)[0].upper() in EXPLAINED:
+            self.statements.append(' '.join(statement.split()))
+
+    def record(self, route, ctx):
+        """Вызвать маршрут один раз; вернуть (HTTP-статус, запросы без повторов)"""
+        self.statements = []
+        _, status, _ = self.request(route, *route.resolve(ctx, 0), fresh=route.fresh)
+        # Запросы, отличающиеся только значениями, проверяются один раз
+        unique = {}
+        for sql in self.statements:
+            unique.setdefault(_LITERAL.sub('?', sql), sql)
+        return status, list(unique.values())
+
+
+def aliases(sql):
+    """Имена и псевдонимы таблиц запроса -> имя таблицы"""
+    names = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        table = table.split('.')[-1]
+        names[table] = table
+        if alias and alias.upper() not in _NOT_ALIAS:
+            names[alias] = table
+    return names
+
+
+def explain(conn, sql, sizes, min_rows):
+    """План запроса и его проблемы: ([строки плана], [проблемы])"""
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    names = aliases(sql)
+    large = set()
+    problems = []
+    for detail in plan:
+        match = _SEARCH_OR_SCAN.match(detail)
+        if not match:
+            continue
+        table = names.get(match.group(1), match.group(1))
+        if sizes.get(table, 0) < min_rows:
+            continue
+        large.add(table)
+        if _SCAN.match(detail):
+            problems.append(f'SCAN {table}')
+    for detail in plan:
+        if detail.startswith('USE TEMP B-TREE') and large:
+            problems.append(f'{detail} ({", ".join(sorted(large))})')
+    return plan, problems
+
+
+def table_sizes(conn):
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%'")]
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+
+def check(database, min_rows=1000, only=None, verbose=True):
+    """Проверить планы запросов маршрутов; вернуть список непозволенных проблем"""
+    routes = [r for r in ROUTES if not only or r.name in only]
+    recorder = Recorder(database)
+    ctx = Context(database, need=10)
+    import db
+    conn = db.connect(database)
+    sizes = table_sizes(conn)
+
+    failures = []
+    for route in routes:
+        status, statements = recorder.record(route, ctx)
+        print(f'\n== {route.name} ({route.method} {route.endpoint}) -> {status}, '
+              f'запросов: {len(statements)}')
+        for sql in statements:
+            plan, problems = explain(conn, sql, sizes, min_rows)
+            new = [p for p in problems if (route.endpoint, p.split(' (')[0]) not in ALLOWED]
+            failures.extend(f'{route.name}: {p}: {sql[:200]}' for p in new)
+            if not verbose and not problems:
+                continue
+            print(f'  {"!" if new else " "} {sql[:160]}')
+            for detail in plan:
+                print(f'        {detail}')
+            for problem in problems:
+                reason = ALLOWED.get((route.endpoint, problem.split(' (')[0]))
+                print(f'      {"допустимо" if reason else "ПРОБЛЕМА"}: {problem}'
+                      + (f' - {reason}' if reason else ''))
+    conn.close()
+
+    endpoints = recorder.endpoints()
+    if not only:
+        missing = sorted(endpoints - {route.endpoint for route in ROUTES})
+        if missing:
+            print(f'\nНе проверены (нет сценария в bench.run.ROUTES): {", ".join(missing)}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Проверить планы SQL-запросов маршрутов')
+    parser.add_argument('--db', default='bench.db', help='БД, заполненная bench.seed')
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help='таблицы меньше этого размера не проверяются')
+    parser.add_argument('--route', action='append', help='проверить только этот маршрут')
+    parser.add_argument('--quiet', action='store_true', help='печатать только запросы с проблемами')
+    args = parser.parse_args(argv)
+
+    source = os.path.abspath(args.db)
+    if not os.path.exists(source):
+        parser.error(f'{args.db} не найдена, создайте ее: python -m bench.seed --db {args.db}')
+
+    # Маршруты записи меняют и удаляют данные - работаем с копией
+    workdir = tempfile.mkdtemp(prefix='gvsu-plans-')
+    database = os.path.join(workdir, 'plans.db')
+    try:
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(database)
+        src.backup(dst)
+        dst.close()
+        src.close()
+        failures = check(database, args.min_rows, args.route, verbose=not args.quiet)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f'\nПроблемы планов ({len(failures)}):')
+        for failure in failures:
+            print(f'  {failure}')
+        return 1
+    print('\nПроблем в планах запросов нет')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,574 @@
+"""Прогон маршрутов приложения с замером задержек.
+
+Каждый маршрут вызывается заданное число раз (после прогрева) под нужной
+ролью: аноним, одобренный пользователь (bench_user из bench.seed) или
+администратор. По каждому маршруту считаются p50/p95/p99, среднее,
+пропускная способность и число SQL-запросов на один HTTP-запрос.
+
+Режимы:
+  flask    - тестовый клиент Flask в этом же процессе (по умолчанию);
+             считает SQL-запросы через трассировку соединения. Записи идут
+             через очередь писателя, как в продакшене; соединение писателя
+             трассируется тоже, так что его запросы попадают в счетчик
+             маршрута.
+  gunicorn - настоящий gunicorn на локальном порту, запросы по HTTP из
+             --concurrency потоков; число SQL-запросов недоступно.
+
+Результат сохраняется в JSON (--out). С --baseline результаты сравниваются
+с сохраненными, и при регрессии (p95 хуже на --tolerance и больше чем на
+--min-delta-ms, либо выросло число запросов) процесс завершается с кодом 1.
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.seed import BENCH_PASSWORD, BENCH_USERNAME  # noqa: E402
+
+ADMIN_USERNAME = 'admin'
+ADMIN_PASSWORD = 'admin123'
+
+
+class Route:
+    """Сценарий одного маршрута.
+
+    path и data - строки/словари или функции (ctx, i) -> значение, где i -
+    номер вызова. fresh - перед каждым вызовом входить заново (для выхода).
+    repeat - свое число вызовов для тяжелых маршрутов (экспорт).
+    """
+
+    def __init__(self, name, endpoint, path, role=None, method='GET', data=None,
+                 files=None, fresh=False, repeat=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.path = path
+        self.role = role
+        self.method = method
+        self.data = data
+        self.files = files
+        self.fresh = fresh
+        self.repeat = repeat
+
+    def resolve(self, ctx, i):
+        path = self.path(ctx, i) if callable(self.path) else self.path
+        data = self.data(ctx, i) if callable(self.data) else self.data
+        files = self.files(ctx, i) if callable(self.files) else self.files
+        return path, data, files
+
+
+class Context:
+    """Идентификаторы записей из БД, которые нужны маршрутам"""
+
+    def __init__(self, path, need):
+        conn = sqlite3.connect(path)
+        one = lambda sql, *args: (conn.execute(sql, args).fetchone() or (0,))[0]  # noqa: E731
+        ids = lambda sql, *args: [r[0] for r in conn.execute(sql + ' LIMIT ?', (*args, need))]  # noqa: E731
+        self.run_id = int(time.time())
+        self.bench_user = one('SELECT id FROM users WHERE username = ?', BENCH_USERNAME)
+        if not self.bench_user:
+            raise SystemExit(f'В БД нет пользователя {BENCH_USERNAME}, заполните ее через bench.seed')
+        self.own_protocol = one('SELECT MAX(id) FROM protocols WHERE user_id = ?', self.bench_user)
+        self.protocol = one('SELECT MAX(id) FROM protocols')
+        self.case = one('SELECT MAX(id) FROM cases')
+        self.user = one('SELECT MAX(id) FROM users WHERE id != ?', self.bench_user)
+        self.counts = {table: one(f'SELECT COUNT(*) FROM {table}')
+                       for table in ('users', 'employees', 'cases', 'protocols', 'news')}
+        # Записи, которые удаляются/меняются по одной на вызов
+        self.pools = {
+            'pending_users': ids("SELECT id FROM users WHERE status = 'pending' ORDER BY id"),
+            'pending_users_reject': ids("SELECT id FROM users WHERE status = 'pending' "
+                                        "ORDER BY id DESC"),
+            'rejected_users': ids("SELECT id FROM users WHERE status = 'rejected' ORDER BY id"),
+            'news': ids('SELECT id FROM news ORDER BY id'),
+            'employees': ids('SELECT id FROM employees ORDER BY id'),
+            'cases': ids('SELECT id FROM cases ORDER BY id'),
+            'own_protocols': ids('SELECT id FROM protocols WHERE user_id = ? ORDER BY id',
+                                 self.bench_user),
+            'protocols': ids('SELECT id FROM protocols WHERE user_id != ? ORDER BY id',
+                             self.bench_user),
+        }
+        conn.close()
+
+    def take(self, pool):
+        """Следующий идентификатор из пула (0, если пул исчерпан)"""
+        items = self.pools[pool]
+        return items.pop(0) if items else 0
+
+
+def _csv_upload(ctx, i):
+    rows = '\n'.join(f'Импорт {ctx.run_id}-{i}-{n},Текст новости,2024-01-01' for n in range(50))
+    return {'file': ('news.csv', 'title,content,date\n' + rows + '\n')}
+
+
+# Порядок важен: сначала чтение на полном наборе данных, затем запись,
+# затем удаление и выход из системы
+ROUTES = [
+    Route('index', 'index', '/'),
+    Route('register_form', 'register', '/register'),
+    Route('user_login_form', 'user_login', '/user/login'),
+    Route('admin_login_form', 'admin_login', '/admin/login'),
+
+    Route('user_dashboard', 'user_dashboard', '/user/dashboard', role='user'),
+    Route('user_create_protocol_form', 'create_protocol', '/user/protocols/create', role='user'),
+    Route('user_view_protocol', 'view_protocol',
+          lambda ctx, i: f'/user/protocols/{ctx.own_protocol}', role='user'),
+    Route('user_search', 'user_search', '/user/search?q=допрос', role='user'),
+
+    Route('admin_dashboard', 'admin_dashboard', '/admin/dashboard', role='admin'),
+    Route('admin_news', 'admin_news', '/admin/news', role='admin'),
+    Route('admin_employees', 'admin_employees', '/admin/employees', role='admin'),
+    Route('admin_cases', 'admin_cases', '/admin/cases', role='admin'),
+    Route('admin_cases_open', 'admin_cases', '/admin/cases?status=open', role='admin'),
+    Route('admin_users', 'admin_users', '/admin/users', role='admin'),
+    Route('admin_users_pending', 'admin_users', '/admin/users?status=pending', role='admin'),
+    Route('admin_pending_users', 'admin_pending_users', '/admin/users/pending', role='admin'),
+    Route('admin_edit_user_form', 'edit_user', lambda ctx, i: f'/admin/users/{ctx.user}/edit',
+          role='admin'),
+    Route('admin_protocols', 'admin_protocols', '/admin/protocols', role='admin'),
+    Route('admin_view_protocol', 'admin_view_protocol',
+          lambda ctx, i: f'/admin/protocols/{ctx.protocol}', role='admin'),
+    Route('admin_search_protocols', 'admin_search', '/admin/search?q=свидетел', role='admin'),
+    Route('admin_search_cases', 'admin_search', '/admin/search?q=дело&scope=cases', role='admin'),
+    Route('admin_reports', 'admin_reports', '/admin/reports', role='admin'),
+    Route('admin_metrics', 'admin_metrics', '/admin/metrics', role='admin'),
+    Route('admin_import_form', 'admin_import', '/admin/import', role='admin'),
+    Route('admin_export_cases', 'admin_export', '/admin/export/cases.csv', role='admin', repeat=5),
+    Route('admin_export_protocols', 'admin_export', '/admin/export/protocols.jsonl',
+          role='admin', repeat=3),
+
+    Route('api_protocols', 'api.list_records', '/api/v1/protocols', role='admin'),
+    Route('api_protocols_user', 'api.list_records', '/api/v1/protocols', role='user'),
+    Route('api_cases_since', 'api.list_records', '/api/v1/cases?updated_since=2024-06-01',
+          role='admin'),
+    Route('api_users', 'api.list_records', '/api/v1/users?limit=200', role='admin'),
+    Route('api_reports', 'api.get_reports', '/api/v1/reports', role='admin'),
+    Route('api_protocol', 'api.get_record', lambda ctx, i: f'/api/v1/protocols/{ctx.protocol}',
+          role='admin'),
+
+    Route('register', 'register', '/register', method='POST',
+          data=lambda ctx, i: {'full_name': 'Бенчмарк', 'username': f'bench-{ctx.run_id}-{i}',
+                               'password': 'password'}),
+    Route('user_login', 'user_login', '/user/login', method='POST',
+          data={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD}),
+    Route('admin_login', 'admin_login', '/admin/login', method='POST',
+          data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}),
+    Route('user_create_protocol', 'create_protocol', '/user/protocols/create', role='user',
+          method='POST',
+          data=lambda ctx, i: {'case_id': ctx.case, 'title': f'Протокол {ctx.run_id}-{i}',
+                               'content': 'Текст протокола ' * 50, 'protocol_number': f'Б-{i}'}),
+    Route('admin_add_news', 'admin_news', '/admin/news', role='admin', method='POST',
+          data=lambda ctx, i: {'title': f'Новость {ctx.run_id}-{i}', 'content': 'Текст',
+                               'date': '2024-01-01'}),
+    Route('admin_add_employee', 'admin_employees', '/admin/employees', role='admin', method='POST',
+          data=lambda ctx, i: {'full_name': f'Сотрудник {ctx.run_id}-{i}',
+                               'position': 'Следователь'}),
+    Route('admin_add_case', 'admin_cases', '/admin/cases', role='admin', method='POST',
+          data=lambda ctx, i: {'title': f'Дело {ctx.run_id}-{i}', 'case_number': f'Б-{i}'}),
+    Route('admin_edit_user', 'edit_user', lambda ctx, i: f'/admin/users/{ctx.user}/edit',
+          role='admin', method='POST',
+          data=lambda ctx, i: {'full_name': 'Бенчмарк', 'username': f'bench-edit-{ctx.run_id}',
+                               'password': 'password', 'status': 'approved'}),
+    Route('admin_approve_user', 'approve_user',
+          lambda ctx, i: f'/admin/users/{ctx.take("pending_users")}/approve',
+          role='admin', method='POST'),
+    Route('admin_reject_user', 'reject_user',
+          lambda ctx, i: f'/admin/users/{ctx.take("pending_users_reject")}/reject',
+          role='admin', method='POST'),
+    Route('admin_bulk_approve', 'bulk_users', '/admin/users/bulk', role='admin', method='POST',
+          data=lambda ctx, i: {'action': 'approve', 'scope': 'selected',
+                               'ids': [ctx.take('pending_users') for _ in range(10)]}),
+    Route('admin_import', 'admin_import', '/admin/import', role='admin', method='POST',
+          data={'table': 'news'}, files=_csv_upload, repeat=10),
+    Route('api_batch_create', 'api.batch', '/api/v1/news/batch', role='admin', method='POST',
+          data=lambda ctx, i: {'create': [{'title': f'API {ctx.run_id}-{i}-{n}', 'content': 'Текст',
+                                           'date': '2024-01-01'} for n in range(100)]},
+          repeat=10),
+
+    Route('user_delete_protocol', 'delete_protocol',
+          lambda ctx, i: f'/user/protocols/{ctx.take("own_protocols")}/delete',
+          role='user', method='POST'),
+    Route('admin_delete_protocol', 'admin_delete_protocol',
+          lambda ctx, i: f'/admin/protocols/{ctx.take("protocols")}/delete',
+          role='admin', method='POST'),
+    Route('admin_delete_user', 'delete_user',
+          lambda ctx, i: f'/admin/users/{ctx.take("rejected_users")}/delete',
+          role='admin', method='POST'),
+    Route('admin_delete_news', 'delete_news',
+          lambda ctx, i: f'/admin/news/delete/{ctx.take("news")}', role='admin'),
+    Route('admin_delete_employee', 'delete_employee',
+          lambda ctx, i: f'/admin/employees/{ctx.take("employees")}/delete', role='admin'),
+    Route('admin_delete_case', 'delete_case',
+          lambda ctx, i: f'/admin/cases/{ctx.take("cases")}/delete', role='admin'),
+
+    Route('user_logout', 'user_logout', '/user/logout', role='user', fresh=True),
+    Route('admin_logout', 'admin_logout', '/admin/logout', role='admin', fresh=True),
+]
+
+# Маршруты, которые не нужно мерить
+SKIPPED_ENDPOINTS = {'static', 'asset'}
+
+LOGINS = {
+    'user': ('/user/login', {'username': BENCH_USERNAME, 'password': BENCH_PASSWORD}),
+    'admin': ('/admin/login', {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}),
+}
+
+
+class FlaskDriver:
+    """Запросы через тестовый клиент Flask с подсчетом SQL-запросов"""
+
+    name = 'flask'
+
+    def __init__(self, database):
+        # db читает DATABASE_URL при импорте (а bench.seed уже импортировал db)
+        import db
+        db.DATABASE = database
+        from app import app
+        import ratelimit
+        import writer
+        # Бенчмарк входит и регистрируется сотни раз - лимиты частоты ему не нужны
+        ratelimit.RATE_LIMITS.clear()
+        ratelimit.RATE_LIMITS_USERNAME.clear()
+        self.app = app
+        self.queries = 0
+        self.last_statement = None
+        tracer = self._trace
+        execute_batch = writer.execute_batch
+
+        # Писатель работает в своем потоке и со своим соединением - трассируем
+        # и его: пока задание выполняется, поток запроса ждет результат
+        def traced_batch(conn, jobs):
+            conn.set_trace_callback(tracer)
+            return execute_batch(conn, jobs)
+
+        writer.execute_batch = traced_batch
+
+        @app.before_request
+        def _bench_trace():
+            self.queries = 0
+            self.last_statement = None
+            db.get_db().set_trace_callback(tracer)
+
+        self.clients = {}
+
+    def _trace(self, statement):
+        # Служебные запросы FTS5 обращаются к 'main'.'<таблица>' (или идут
+        # комментарием "-- ..."), операторы триггеров sqlite3 сообщает текстом
+        # родительского запроса - их не считаем. Подряд идущие повторы
+        # считаются одним запросом, так же считается и executemany
+        if statement.startswith('--') or "'main'." in statement:
+            return
+        if statement != self.last_statement:
+            self.queries += 1
+        self.last_statement = statement
+
+    def client(self, role, fresh=False):
+        if role in self.clients and not fresh:
+            return self.clients[role]
+        client = self.app.test_client()
+        if role:
+            path, data = LOGINS[role]
+            client.post(path, data=data)
+        self.clients[role] = client
+        return client
+
+    def request(self, route, path, data, files, fresh=False):
+        """Выполнить запрос; вернуть (секунды, HTTP-статус, число SQL-запросов)"""
+        client = self.client(route.role, fresh)
+        kwargs = {}
+        if route.name.startswith('api_') and data is not None:
+            kwargs['json'] = data
+        elif files:
+            kwargs['data'] = dict(data or {})
+            for field, (filename, content) in files.items():
+                kwargs['data'][field] = (io.BytesIO(content.encode('utf-8')), filename)
+            kwargs['content_type'] = 'multipart/form-data'
+        elif data is not None:
+            kwargs['data'] = data
+        started = time.perf_counter()
+        response = client.open(path, method=route.method, **kwargs)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        response.close()
+        return elapsed, response.status_code, self.queries
+
+    def endpoints(self):
+        return {rule.endpoint for rule in self.app.url_map.iter_rules()} - SKIPPED_ENDPOINTS
+
+    def close(self):
+        pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpDriver:
+    """Запросы по HTTP к gunicorn, запущенному на свободном порту"""
+
+    name = 'gunicorn'
+
+    def __init__(self, database, workers=2, threads=1, worker_class='sync', extra_args=()):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        self.base = f'http://127.0.0.1:{port}'
+        env = dict(os.environ, DATABASE_URL=database, GUNICORN_ACCESSLOG='')
+        env.setdefault('SLOW_QUERY_MS', '1000')
+        # Бенчмарк входит и регистрируется сотни раз - лимиты частоты отключены
+        env.setdefault('RATE_LIMITS', 'user_login=0/0,admin_login=0/0,register=0/0')
+        env.setdefault('RATE_LIMITS_USERNAME', 'user_login=0/0,admin_login=0/0')
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--threads', str(threads),
+                   '--worker-class', worker_class, *extra_args, 'app:app']
+        self.process = subprocess.Popen(command, cwd=ROOT, env=env)
+        self._wait()
+        self.local = threading.local()
+
+    def _wait(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit('gunicorn завершился при запуске')
+            try:
+                urllib.request.urlopen(self.base + '/user/login', timeout=1).read()
+                return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.2)
+        self.close()
+        raise SystemExit('gunicorn не ответил за отведенное время')
+
+    def _opener(self, role, fresh=False):
+        openers = self.local.__dict__.setdefault('openers', {})
+        if role in openers and not fresh:
+            return openers[role]
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+        if role:
+            path, data = LOGINS[role]
+            self._open(opener, path, 'POST', urllib.parse.urlencode(data).encode(), {})
+        openers[role] = opener
+        return opener
+
+    def _open(self, opener, path, method, body, headers):
+        req = urllib.request.Request(self.base + urllib.parse.quote(path, safe='/?=&'),
+                                     data=body, method=method, headers=headers)
+        try:
+            with opener.open(req, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def request(self, route, path, data, files, fresh=False):
+        opener = self._opener(route.role, fresh)
+        headers = {}
+        body = None
+        if route.name.startswith('api_') and data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif files:
+            boundary = f'bench{time.perf_counter_ns()}'
+            parts = []
+            for field, value in (data or {}).items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"'
+                             f'\r\n\r\n{value}\r\n')
+            for field, (filename, content) in files.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                             f'filename="{filename}"\r\nContent-Type: text/csv\r\n\r\n{content}\r\n')
+            parts.append(f'--{boundary}--\r\n')
+            body = ''.join(parts).encode('utf-8')
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif data is not None:
+            body = urllib.parse.urlencode(data, doseq=True).encode('utf-8')
+        elif route.method == 'POST':
+            body = b''
+        started = time.perf_counter()
+        status = self._open(opener, path, route.method, body, headers)
+        return time.perf_counter() - started, status, None
+
+    def endpoints(self):
+        return None
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def percentile(values, p):
+    """Перцентиль p (0-100) методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def measure(driver, route, ctx, requests, warmup, concurrency=1):
+    """Прогреть и замерить один маршрут; вернуть сводку"""
+    count = route.repeat or requests
+    for i in range(0 if route.repeat else warmup):
+        driver.request(route, *route.resolve(ctx, -1 - i), fresh=route.fresh)
+
+    def call(i):
+        return driver.request(route, *route.resolve(ctx, i), fresh=route.fresh)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            samples = list(pool.map(call, range(count)))
+    else:
+        samples = [call(i) for i in range(count)]
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, _, _ in samples]
+    queries = [q for _, _, q in samples if q is not None]
+    return {
+        'endpoint': route.endpoint,
+        'method': route.method,
+        'count': count,
+        'errors': sum(1 for _, status, _ in samples if status >= 500),
+        'statuses': {str(code): sum(1 for _, status, _ in samples if status == code)
+                     for code in sorted({status for _, status, _ in samples})},
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'rps': round(count / wall, 1) if wall else None,
+        'queries': round(sum(queries) / len(queries), 1) if queries else None,
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Список регрессий относительно baseline"""
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = results['routes'].get(name)
+        if current is None:
+            continue
+        if current['errors'] > base.get('errors', 0):
+            regressions.append(f'{name}: ошибок {current["errors"]} (было {base.get("errors", 0)})')
+        limit = base['p95_ms'] * (1 + tolerance)
+        if current['p95_ms'] > limit and current['p95_ms'] - base['p95_ms'] > min_delta_ms:
+            regressions.append(f'{name}: p95 {current["p95_ms"]:.1f} мс (было {base["p95_ms"]:.1f} мс)')
+        if (base.get('queries') is not None and current['queries'] is not None
+                and current['queries'] > base['queries']):
+            regressions.append(f'{name}: SQL-запросов {current["queries"]} (было {base["queries"]})')
+    return regressions
+
+
+def print_table(results):
+    header = f'{"маршрут":<28} {"p50":>8} {"p95":>8} {"p99":>8} {"req/s":>8} {"SQL":>6} {"ош.":>4}'
+    print(header)
+    print('-' * len(header))
+    for name, r in results['routes'].items():
+        queries = '-' if r['queries'] is None else f'{r["queries"]:g}'
+        print(f'{name:<28} {r["p50_ms"]:>8.2f} {r["p95_ms"]:>8.2f} {r["p99_ms"]:>8.2f} '
+              f'{r["rps"] or 0:>8.1f} {queries:>6} {r["errors"]:>4}')
+
+
+def run(driver, database, requests=50, warmup=5, concurrency=1, only=None):
+    """Прогнать все маршруты (или только перечисленные в only)"""
+    routes = [r for r in ROUTES if not only or r.name in only]
+    ctx = Context(database, need=max([r.repeat or requests for r in routes] + [0]) + warmup)
+    results = {
+        'meta': {
+            'mode': driver.name,
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'requests': requests,
+            'warmup': warmup,
+            'concurrency': concurrency,
+            'rows': ctx.counts,
+        },
+        'routes': {},
+    }
+    for route in routes:
+        results['routes'][route.name] = measure(driver, route, ctx, requests, warmup, concurrency)
+
+    endpoints = driver.endpoints()
+    if endpoints is not None and not only:
+        missing = sorted(endpoints - {route.endpoint for route in ROUTES})
+        results['meta']['unmeasured_endpoints'] = missing
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк маршрутов приложения')
+    parser.add_argument('--db', default='bench.db', help='БД, заполненная bench.seed')
+    parser.add_argument('--mode', choices=('flask', 'gunicorn'), default='flask')
+    parser.add_argument('--requests', type=int, default=50, help='вызовов на маршрут')
+    parser.add_argument('--warmup', type=int, default=5, help='прогревочных вызовов')
+    parser.add_argument('--concurrency', type=int, default=1, help='потоков клиента (gunicorn)')
+    parser.add_argument('--workers', type=int, default=2, help='воркеров gunicorn')
+    parser.add_argument('--threads', type=int, default=1, help='потоков на воркер gunicorn')
+    parser.add_argument('--worker-class', default='sync', help='класс воркера gunicorn')
+    parser.add_argument('--route', action='append', help='мерить только этот маршрут')
+    parser.add_argument('--out', help='сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='сравнить с сохраненными результатами')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='допустимое ухудшение p95 (доля)')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help='игнорировать ухудшение p95 меньше этого значения')
+    args = parser.parse_args(argv)
+
+    database = os.path.abspath(args.db)
+    if not os.path.exists(database):
+        parser.error(f'{args.db} не найдена, создайте ее: python -m bench.seed --db {args.db}')
+
+    if args.mode == 'gunicorn':
+        driver = HttpDriver(database, args.workers, args.threads, args.worker_class)
+    else:
+        driver = FlaskDriver(database)
+    try:
+        results = run(driver, database, args.requests, args.warmup, args.concurrency, args.route)
+    finally:
+        driver.close()
+    if args.mode == 'gunicorn':
+        results['meta'].update(workers=args.workers, threads=args.threads,
+                               worker_class=args.worker_class)
+
+    print_table(results)
+    missing = results['meta'].get('unmeasured_endpoints')
+    if missing:
+        print(f'\nНе измерены: {", ".join(missing)}')
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print('\nРегрессии:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print('\nРегрессий нет')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""Генератор синтетических данных по схеме приложения.
+
+Объемы по умолчанию соответствуют крупной инсталляции: 100 тыс.
+пользователей, 10 тыс. дел, 1 млн протоколов. Для быстрых прогонов
+используйте --scale (например, --scale 0.01).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from migrations import index_search, migrate  # noqa: E402
+
+# Учетные записи, под которыми бенчмарк ходит по страницам пользователя
+BENCH_USERNAME = 'bench_user'
+BENCH_PASSWORD = 'bench_password'
+
+WORDS = (
+    'протокол допроса свидетеля обвиняемого потерпевшего осмотра места происшествия '
+    'военнослужащий воинская часть следователь управление округ гарнизон уголовное дело '
+    'возбуждено расследование статья кодекса показания установлено время дата подпись '
+    'экспертиза заключение документы изъяты имущество служба контракт приказ командир '
+    'рапорт объяснение очная ставка обыск выемка вещественные доказательства'
+).split()
+RANKS = ('рядовой', 'сержант', 'лейтенант', 'старший лейтенант', 'капитан', 'майор', 'подполковник')
+POSITIONS = ('Следователь', 'Старший следователь', 'Старший следователь по особо важным делам',
+             'Руководитель следственного отдела', 'Помощник следователя', 'Специалист')
+CHUNK = 10000
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _timestamps(rng, count, days):
+    """Случайные моменты за последние days дней в формате CURRENT_TIMESTAMP"""
+    now = datetime(2025, 1, 1)
+    seconds = days * 86400
+    for _ in range(count):
+        yield (now - timedelta(seconds=rng.randrange(seconds))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _insert(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def seed(path, users=100000, employees=500, cases=10000, protocols=1000000, news=2000,
+         content_words=60, seed_value=42, quiet=False):
+    """Создать БД path и заполнить ее синтетическими данными"""
+    rng = random.Random(seed_value)
+    migrate(path)
+    conn = db.connect(path)
+    # Данные генерируются заново, надежность записи не нужна
+    conn.execute('PRAGMA synchronous = OFF')
+
+    def step(name, func):
+        started = time.perf_counter()
+        func()
+        conn.commit()
+        if not quiet:
+            print(f'{name}: {time.perf_counter() - started:.1f} с')
+
+    def fill_users():
+        statuses = ['approved'] * 16 + ['pending'] * 3 + ['rejected']
+        rows = ((f'Пользователь {i}', f'user{i}', 'password', f'{rng.randint(1, 30)} лет',
+                 'высшее', rng.choice(RANKS), rng.choice(statuses), ts)
+                for i, ts in enumerate(_timestamps(rng, users, 1000)))
+        _insert(conn, '''INSERT INTO users (full_name, username, password, experience, education,
+                         rank, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        conn.execute('''INSERT OR IGNORE INTO users (full_name, username, password, status)
+                        VALUES ('Бенчмарк', ?, ?, 'approved')''', (BENCH_USERNAME, BENCH_PASSWORD))
+
+    def fill_employees():
+        rows = ((f'Сотрудник {i}', rng.choice(POSITIONS), f'Отдел {rng.randint(1, 20)}', ts)
+                for i, ts in enumerate(_timestamps(rng, employees, 2000)))
+        _insert(conn, 'INSERT INTO employees (full_name, position, department, created_at) '
+                      'VALUES (?, ?, ?, ?)', rows)
+
+    def fill_cases():
+        statuses = ['open'] * 3 + ['in_progress'] * 3 + ['closed'] * 4
+        rows = ((f'Дело {i}: {_text(rng, 4)}', _text(rng, 25), f'{i}/{rng.randint(20, 25)}',
+                 rng.randint(1, employees) if employees else None, rng.choice(statuses), ts)
+                for i, ts in enumerate(_timestamps(rng, cases, 1500)))
+        _insert(conn, '''INSERT INTO cases (title, description, case_number, assigned_to, status,
+                         created_at) VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+    def fill_protocols():
+        bench_id = conn.execute('SELECT id FROM users WHERE username = ?',
+                                (BENCH_USERNAME,)).fetchone()[0]
+        max_user = conn.execute('SELECT MAX(id) FROM users').fetchone()[0]
+
+        def rows():
+            for i, ts in enumerate(_timestamps(rng, protocols, 1000)):
+                # Каждый сотый протокол - у бенчмарк-пользователя (его кабинет не пуст)
+                user_id = bench_id if i % 100 == 0 else rng.randint(1, max_user)
+                yield (rng.randint(1, cases), user_id, f'Протокол {i}: {_text(rng, 3)}',
+                       _text(rng, content_words), f'П-{i}', ts)
+        _insert(conn, '''INSERT INTO protocols (case_id, user_id, title, content, protocol_number,
+                         created_at) VALUES (?, ?, ?, ?, ?, ?)''', rows())
+
+    def fill_news():
+        rows = ((f'Новость {i}', _text(rng, 80), ts[:10], ts)
+                for i, ts in enumerate(_timestamps(rng, news, 2000)))
+        _insert(conn, 'INSERT INTO news (title, content, date, created_at) VALUES (?, ?, ?, ?)', rows)
+
+    step('users', fill_users)
+    step('employees', fill_employees)
+    step('cases', fill_cases)
+    step('protocols', fill_protocols)
+    # Поиск по протоколам заполняет приложение, а не триггеры
+    step('search', lambda: index_search(conn, 'protocols'))
+    step('news', fill_news)
+    step('analyze', lambda: conn.execute('ANALYZE'))
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Заполнить БД синтетическими данными')
+    parser.add_argument('--db', default='bench.db', help='путь к создаваемой БД')
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель объемов')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--employees', type=int, default=500)
+    parser.add_argument('--cases', type=int, default=10000)
+    parser.add_argument('--protocols', type=int, default=1000000)
+    parser.add_argument('--news', type=int, default=2000)
+    parser.add_argument('--content-words', type=int, default=60, help='слов в тексте протокола')
+    parser.add_argument('--force', action='store_true', help='удалить существующую БД')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f'{args.db} уже существует (используйте --force)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    def scaled(value):
+        return max(1, int(value * args.scale))
+
+    seed(args.db, users=scaled(args.users), employees=scaled(args.employees),
+         cases=scaled(args.cases), protocols=scaled(args.protocols), news=scaled(args.news),
+         content_words=args.content_words)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Сравнение режимов gunicorn: sync и gthread.
+
+Поднимает gunicorn с gunicorn.conf.py дважды - с синхронными воркерами и с
+потоками (gthread) при одинаковом числе процессов - и прогоняет по HTTP
+одни и те же маршруты с одинаковой конкурентностью клиента:
+
+    python -m bench.workers --db bench.db --workers 2 --threads 4 --concurrency 16
+
+Маршруты с записью удаляют и изменяют данные, поэтому по умолчанию
+меряются только маршруты чтения (см. READ_ROUTES).
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.run import ROUTES, HttpDriver, run  # noqa: E402
+
+# Маршруты до первой записи в ROUTES (см. порядок там)
+READ_ROUTES = [route.name for route in ROUTES[:ROUTES.index(
+    next(route for route in ROUTES if route.method == 'POST'))]
+    if not route.name.startswith('admin_export')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнить sync и gthread воркеры gunicorn')
+    parser.add_argument('--db', default='bench.db')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16, help='потоков клиента')
+    parser.add_argument('--requests', type=int, default=200, help='вызовов на маршрут')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--route', action='append', help='мерить только этот маршрут')
+    parser.add_argument('--out', help='сохранить результаты обоих режимов в JSON')
+    args = parser.parse_args(argv)
+
+    database = os.path.abspath(args.db)
+    if not os.path.exists(database):
+        parser.error(f'{args.db} не найдена, создайте ее: python -m bench.seed --db {args.db}')
+
+    routes = args.route or READ_ROUTES
+    results = {}
+    for worker_class, threads in (('sync', 1), ('gthread', args.threads)):
+        driver = HttpDriver(database, args.workers, threads, worker_class)
+        try:
+            results[worker_class] = run(driver, database, args.requests, args.warmup,
+                                        args.concurrency, routes)
+        finally:
+            driver.close()
+        results[worker_class]['meta'].update(workers=args.workers, threads=threads,
+                                             worker_class=worker_class)
+
+    sync, threaded = results['sync']['routes'], results['gthread']['routes']
+    print(f'{args.workers} воркера, gthread: {args.threads} потока, клиент: {args.concurrency} потоков\n')
+    header = (f'{"маршрут":<28} {"sync req/s":>11} {"gthread req/s":>14} {"x":>6} '
+              f'{"sync p95":>9} {"gthread p95":>12}')
+    print(header)
+    print('-' * len(header))
+    total_sync = total_threaded = 0.0
+    for name in sync:
+        a, b = sync[name], threaded[name]
+        total_sync += a['rps'] or 0
+        total_threaded += b['rps'] or 0
+        ratio = b['rps'] / a['rps'] if a['rps'] else 0
+        print(f'{name:<28} {a["rps"]:>11.1f} {b["rps"]:>14.1f} {ratio:>6.2f} '
+              f'{a["p95_ms"]:>9.1f} {b["p95_ms"]:>12.1f}')
+    if total_sync:
+        print(f'\nСуммарно: sync {total_sync:.0f} req/s, gthread {total_threaded:.0f} req/s '
+              f'(x{total_threaded / total_sync:.2f})')
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
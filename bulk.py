@@ -0,0 +1,315 @@
+"""Массовый импорт и потоковый экспорт данных (CSV и JSON Lines).
+
+Загруженный файл разбирается построчно, без чтения целиком в память.
+Корректные строки вставляются пачками через executemany, каждая пачка -
+отдельная транзакция. Если пачка нарушает ограничение БД (например,
+повторяющийся логин), она повторяется построчно в одной транзакции, чтобы
+найти виновные строки, остальные строки пачки все равно вставляются.
+
+Ссылки на другие таблицы (IMPORT_REFERENCES) проверяются до вставки:
+внешние ключи в SQLite не включены, и без проверки импорт создал бы
+протоколы несуществующих дел или авторов.
+
+Экспорт читает результат запроса курсором порциями (fetchmany) и отдает
+их генератором, поэтому память не зависит от числа строк.
+"""
+import csv
+import io
+import json
+import os
+from datetime import date
+
+import db
+from compression import PACKED_COLUMNS, pack_values, unpack_text
+from migrations import index_search
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+# Сколько ошибок показывать в отчете (считаются все)
+MAX_REPORTED_ERRORS = 200
+
+FORMATS = ('csv', 'jsonl')
+
+
+class RowError(ValueError):
+    """Строка не прошла проверку"""
+
+
+def _text(required=False, default=''):
+    def convert(value):
+        value = (value if value is not None else '')
+        value = str(value).strip()
+        if not value:
+            if required:
+                raise RowError('обязательное поле не заполнено')
+            return default
+        return value
+    return convert
+
+
+def _integer(required=False):
+    def convert(value):
+        if value is None or str(value).strip() == '':
+            if required:
+                raise RowError('обязательное поле не заполнено')
+            return None
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            raise RowError(f'ожидается число, получено {value!r}')
+    return convert
+
+
+def _choice(choices, default):
+    def convert(value):
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            return default
+        if value not in choices:
+            raise RowError(f'недопустимое значение {value!r}, ожидается одно из: {", ".join(choices)}')
+        return value
+    return convert
+
+
+def _date(value):
+    value = _text(required=True)(value)
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        raise RowError(f'ожидается дата в формате ГГГГ-ММ-ДД, получено {value!r}')
+    return value
+
+
+# Описание импортируемых таблиц: колонка -> преобразование значения
+IMPORT_SPECS = {
+    'users': {
+        'full_name': _text(required=True),
+        'username': _text(required=True),
+        'password': _text(required=True),
+        'experience': _text(),
+        'education': _text(),
+        'rank': _text(),
+        'status': _choice(('pending', 'approved', 'rejected'), 'pending'),
+    },
+    'employees': {
+        'full_name': _text(required=True),
+        'position': _text(required=True),
+        'department': _text(),
+    },
+    'cases': {
+        'title': _text(required=True),
+        'description': _text(),
+        'case_number': _text(),
+        'assigned_to': _integer(),
+        'status': _choice(('open', 'in_progress', 'closed'), 'open'),
+    },
+    'news': {
+        'title': _text(required=True),
+        'content': _text(required=True),
+        'date': _date,
+    },
+    'protocols': {
+        'case_id': _integer(required=True),
+        'user_id': _integer(required=True),
+        'title': _text(required=True),
+        'content': _text(required=True),
+        'protocol_number': _text(),
+    },
+}
+
+# Ссылки импортируемых таблиц: колонка -> таблица, в которой должен быть такой id
+IMPORT_REFERENCES = {
+    'cases': {'assigned_to': 'employees'},
+    'protocols': {'case_id': 'cases', 'user_id': 'users'},
+}
+
+# Запросы экспорта: таблица -> SQL
+EXPORT_QUERIES = {
+    'protocols': '''
+        SELECT p.id, p.case_id, c.case_number, p.user_id, u.username,
+               p.title, p.protocol_number, p.content, p.created_at
+        FROM protocols p
+        LEFT JOIN cases c ON p.case_id = c.id
+        LEFT JOIN users u ON p.user_id = u.id
+        ORDER BY p.id
+    ''',
+    'cases': '''
+        SELECT c.id, c.title, c.case_number, c.description, c.status,
+               c.assigned_to, e.full_name as assigned_employee, c.created_at
+        FROM cases c
+        LEFT JOIN employees e ON c.assigned_to = e.id
+        ORDER BY c.id
+    ''',
+}
+
+
+class ImportResult:
+    """Итог импорта: сколько строк прочитано и вставлено, ошибки по строкам"""
+
+    def __init__(self):
+        self.total = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def detect_format(filename, requested=None):
+    """Формат файла: явно выбранный или по расширению"""
+    if requested in FORMATS:
+        return requested
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_records(stream, fmt):
+    """Построчно читать записи из бинарного потока: (номер строки, dict или ошибка)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, RowError(f'некорректный JSON: {e}')
+                continue
+            if not isinstance(record, dict):
+                yield line_no, RowError('ожидается JSON-объект')
+                continue
+            yield line_no, record
+    else:
+        reader = csv.DictReader(text)
+        for record in reader:
+            # Номер строки файла (заголовок - первая строка)
+            yield reader.line_num, record
+
+
+def _validate(spec, record):
+    return tuple(convert(record.get(column)) for column, convert in spec.items())
+
+
+def check_references(conn, table, values, known=None):
+    """Проверить, что строки, на которые ссылаются values (колонка -> значение), существуют.
+
+    known - множество уже проверенных (таблица, id), пополняется.
+    """
+    for column, target in IMPORT_REFERENCES.get(table, {}).items():
+        value = values.get(column)
+        if value is None or (known is not None and (target, value) in known):
+            continue
+        if not conn.execute(f'SELECT 1 FROM {target} WHERE id = ?', (value,)).fetchone():
+            raise RowError(f'{column}: в таблице {target} нет записи с id {value}')
+        if known is not None:
+            known.add((target, value))
+
+
+def _insert_batch(conn, table, sql, batch, result):
+    """Вставить пачку одной транзакцией; при нарушении ограничений - построчно"""
+    db.begin_write(conn)
+    last_id = _last_id(conn, table)
+    try:
+        conn.executemany(sql, [values for _, values in batch])
+        _index_inserted(conn, table, last_id)
+        conn.commit()
+        result.inserted += len(batch)
+        return
+    except db.IntegrityError:
+        conn.rollback()
+
+    # Без явной транзакции каждая точка сохранения фиксировалась бы отдельно
+    db.begin_write(conn)
+    last_id = _last_id(conn, table)
+    for line, values in batch:
+        try:
+            conn.execute('SAVEPOINT import_row')
+            conn.execute(sql, values)
+            conn.execute('RELEASE import_row')
+            result.inserted += 1
+        except db.IntegrityError as e:
+            conn.execute('ROLLBACK TO import_row')
+            conn.execute('RELEASE import_row')
+            result.add_error(line, f'нарушено ограничение БД: {e}')
+    _index_inserted(conn, table, last_id)
+    conn.commit()
+
+
+def _last_id(conn, table):
+    # Поиск по таблицам со сжатыми колонками обновляет приложение (migrations.index_search):
+    # вставленные строки - те, что новее последней до вставки (запись уже заблокирована)
+    if table not in PACKED_COLUMNS:
+        return None
+    return conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+
+
+def _index_inserted(conn, table, last_id):
+    if last_id is not None:
+        index_search(conn, table, 'id > ?', (last_id,))
+
+
+def import_records(conn, table, records, batch_size=IMPORT_BATCH_SIZE):
+    """Проверить и вставить записи (итератор из iter_records) в таблицу table"""
+    spec = IMPORT_SPECS[table]
+    columns = ', '.join(spec)
+    sql = f'INSERT INTO {table} ({columns}) VALUES ({", ".join("?" * len(spec))})'
+    # Уже проверенные ссылки: (таблица, id)
+    known = set()
+    result = ImportResult()
+    batch = []
+    for line, record in records:
+        result.total += 1
+        if isinstance(record, RowError):
+            result.add_error(line, str(record))
+            continue
+        try:
+            values = _validate(spec, record)
+            check_references(conn, table, dict(zip(spec, values)), known)
+            batch.append((line, pack_values(conn, table, spec, values)))
+        except RowError as e:
+            result.add_error(line, str(e))
+            continue
+        if len(batch) >= batch_size:
+            _insert_batch(conn, table, sql, batch, result)
+            batch = []
+    if batch:
+        _insert_batch(conn, table, sql, batch, result)
+    return result
+
+
+def _unpack(row, indexes):
+    row = list(row)
+    for i in indexes:
+        row[i] = unpack_text(row[i])
+    return row
+
+
+def export_rows(conn, table, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """Генератор фрагментов файла экспорта таблицы table в формате fmt"""
+    cursor = conn.execute(EXPORT_QUERIES[table])
+    columns = [d[0] for d in cursor.description]
+    # Сжатые колонки распаковываются построчно, по мере выдачи
+    packed = [i for i, column in enumerate(columns) if column in PACKED_COLUMNS.get(table, ())]
+    if fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        yield buf.getvalue()
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        if packed:
+            rows = [_unpack(row, packed) for row in rows]
+        if fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerows(tuple(row) for row in rows)
+            yield buf.getvalue()
+        else:
+            yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                          for row in rows)
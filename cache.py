@@ -0,0 +1,86 @@
+"""Кеш данных в памяти воркера.
+
+Записи кеша помечаются версиями таблиц, от которых зависят (data_versions,
+версии поднимают триггеры при любой записи). Пока запись свежее
+CACHE_REVALIDATE секунд, она отдается без обращения к SQLite; после этого
+версии перечитываются одним запросом и запись перезагружается, только если
+данные изменились. Так все воркеры gunicorn видят изменения не позднее
+CACHE_REVALIDATE секунд, а воркер, выполнивший запись, - сразу.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_db
+
+CACHE_MAXSIZE = int(os.environ.get('CACHE_MAXSIZE', 256))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+CACHE_REVALIDATE = float(os.environ.get('CACHE_REVALIDATE', 2))
+
+
+def table_versions(conn, tables):
+    """Текущие версии данных таблиц tables в виде кортежа"""
+    placeholders = ', '.join('?' * len(tables))
+    rows = dict(conn.execute(f'SELECT name, version FROM data_versions WHERE name IN ({placeholders})',
+                             tables).fetchall())
+    return tuple(rows.get(table, 0) for table in tables)
+
+
+class DataCache:
+    """Ограниченный LRU-кеш с TTL и проверкой версий таблиц"""
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, revalidate=CACHE_REVALIDATE):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, tables):
+        """Значение по ключу key; при промахе или устаревании вызвать loader()"""
+        tables = tuple(tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            value, versions, loaded_at, checked_at, _ = entry
+            if now - loaded_at < self.ttl:
+                if now - checked_at < self.revalidate:
+                    return value
+                if self._versions(tables) == versions:
+                    self._store(key, (value, versions, loaded_at, now, tables))
+                    return value
+
+        # Версии читаем до загрузки: если данные изменятся во время загрузки,
+        # следующая проверка это заметит
+        versions = self._versions(tables)
+        value = loader()
+        self._store(key, (value, versions, now, now, tables))
+        return value
+
+    @staticmethod
+    def _versions(tables):
+        # Фрагменты без зависимостей не требуют обращения к БД
+        return table_versions(get_db(), tables) if tables else ()
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, table=None):
+        """Сбросить записи, зависящие от таблицы table (или все записи)"""
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+                return
+            for key in [key for key, entry in self._entries.items() if table in entry[4]]:
+                del self._entries[key]
+
+
+cache = DataCache()
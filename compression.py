@@ -0,0 +1,63 @@
+"""Сжатое хранение больших текстов (тексты протоколов).
+
+В SQLite длинный текст хранится как BLOB: маркер формата и данные zlib.
+Строки, записанные до включения сжатия, остаются текстом и читаются как
+есть, поэтому переписывать базу не обязательно (см. команду
+compress-protocols). Короткие тексты не сжимаются - выигрыша не будет.
+
+PostgreSQL сам сжимает длинные значения (TOAST), там текст хранится как
+есть. В SQL текст не распаковывается: поиск по протоколам обновляет
+приложение (migrations.index_search). Сторонний клиент SQLite может писать
+в таблицу, но индекс поиска при этом не меняется - после такой записи его
+нужно перестроить командой rebuild-search.
+"""
+import os
+import sqlite3
+import zlib
+
+PACK_MIN_SIZE = int(os.environ.get('PACK_MIN_SIZE', 256))
+PACK_LEVEL = int(os.environ.get('PACK_LEVEL', 6))
+
+# Префикс сжатого значения: формат и версия
+MARKER = b'z1:'
+
+# Сжимаемые колонки таблиц
+PACKED_COLUMNS = {
+    'protocols': ('content',),
+}
+
+
+def pack_text(conn, text):
+    """Значение для записи текста text в сжимаемую колонку"""
+    if text is None or not isinstance(conn, sqlite3.Connection):
+        return text
+    data = text.encode('utf-8')
+    if len(data) < PACK_MIN_SIZE:
+        return text
+    packed = MARKER + zlib.compress(data, PACK_LEVEL)
+    return packed if len(packed) < len(data) else text
+
+
+def unpack_text(value):
+    """Текст из значения сжимаемой колонки (сжатого или записанного как есть)"""
+    if isinstance(value, bytes):
+        if value.startswith(MARKER):
+            value = zlib.decompress(value[len(MARKER):])
+        return value.decode('utf-8')
+    return value
+
+
+def pack_values(conn, table, columns, values):
+    """Сжать значения сжимаемых колонок в строке values (в порядке columns)"""
+    packed = PACKED_COLUMNS.get(table, ())
+    return tuple(pack_text(conn, value) if column in packed else value
+                 for column, value in zip(columns, values))
+
+
+def unpack_row(table, row):
+    """Строку результата в виде dict с распакованными сжимаемыми колонками"""
+    row = dict(zip(row.keys(), row))
+    for column in PACKED_COLUMNS.get(table, ()):
+        if column in row:
+            row[column] = unpack_text(row[column])
+    return row
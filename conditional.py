@@ -0,0 +1,139 @@
+"""Условные GET и сжатие динамических страниц.
+
+Для страниц из PAGE_TABLES слабый ETag вычисляется до выполнения
+обработчика: из версий данных таблиц, от которых зависит страница
+(data_versions, см. cache.py), адреса с параметрами, вошедшего пользователя
+и версии релиза (RELEASE или отпечаток содержимого кода, шаблонов и
+статики). Если браузер прислал тот же ETag в If-None-Match, сразу отдается
+пустой 304 - без запросов страницы и рендеринга. Ответ помечается Cache-Control: private, no-cache: браузер
+хранит страницу, но каждый раз сверяет ее с сервером.
+
+ETag подписан SECRET_KEY (подобрать его для чужой сессии нельзя). Страницы
+с флеш-сообщениями не кешируются: сообщение показывается один раз.
+
+Текстовые ответы (HTML, JSON, CSV, метрики) больше GZIP_MIN_SIZE байт
+сжимаются gzip, если клиент его принимает. Потоковые ответы (экспорт) и
+готовые файлы (assets.py) не трогаются.
+"""
+import gzip
+import hashlib
+import hmac
+import os
+
+from flask import current_app, g, request, session
+
+from assets import DIST_DIR
+from cache import table_versions
+from db import get_db
+from migrations import VERSIONED_TABLES
+
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/csv', 'application/json')
+
+# Страница (endpoint) -> таблицы, от данных которых она зависит
+PAGE_TABLES = {
+    'index': ('news',),
+    'user_dashboard': ('users', 'cases', 'employees', 'protocols'),
+    # Счетчики stats меняются вместе с любой из таблиц
+    'admin_dashboard': VERSIONED_TABLES,
+    'admin_news': ('news',),
+    'admin_employees': ('employees',),
+    'admin_cases': ('cases', 'employees'),
+    'admin_users': ('users',),
+    'admin_pending_users': ('users',),
+    'admin_protocols': ('protocols', 'cases', 'users'),
+    'admin_reports': ('cases', 'protocols', 'users', 'employees'),
+}
+
+# Версия релиза (например, хеш коммита); без нее - отпечаток содержимого файлов
+RELEASE = os.environ.get('RELEASE') or os.environ.get('RAILWAY_GIT_COMMIT_SHA', '')
+
+_build = ''
+
+
+def _build_stamp(app):
+    """Отпечаток кода, шаблонов и статики: после деплоя старые ETag не совпадут.
+
+    Строится по содержимому, а не по времени изменения: у одинаковых файлов на
+    разных репликах и после пересборки образа отпечаток один и тот же.
+    """
+    if RELEASE:
+        return RELEASE
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    files = []
+    for folder in (app.root_path, os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for root, dirs, names in os.walk(folder):
+            # Собранная статика (assets.py) выводится из исходников
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+            if folder == app.root_path:
+                names = [name for name in names if name.endswith('.py')]
+                dirs[:] = []
+            files.extend(os.path.join(root, name) for name in names)
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        digest.update(os.path.relpath(path, app.root_path).encode() + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+def page_etag(tables):
+    """ETag текущей страницы для текущих версий таблиц tables"""
+    versions = table_versions(get_db(), tables)
+    principal = (session.get('admin'), session.get('user_id'), session.get('username'))
+    key = repr((_build, request.full_path, principal, versions)).encode()
+    secret = str(current_app.secret_key).encode()
+    return hmac.new(secret, key, hashlib.sha256).hexdigest()[:32]
+
+
+def _set_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+
+def _check_not_modified():
+    tables = PAGE_TABLES.get(request.endpoint)
+    if tables is None or request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+    # Версии читаются до обработчика: изменения во время рендеринга
+    # дадут другой ETag на следующем запросе
+    etag = g.page_etag = page_etag(tables)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        _set_cache_headers(response, etag)
+        return response
+    return None
+
+
+def compress(response):
+    """Сжать текстовый ответ gzip, если он достаточно большой и клиент согласен"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _finish_response(response):
+    etag = g.pop('page_etag', None)
+    if etag is not None and response.status_code == 200:
+        _set_cache_headers(response, etag)
+    return compress(response)
+
+
+def init_app(app):
+    """Подключить условные GET и сжатие ответов к приложению"""
+    global _build
+    _build = _build_stamp(app)
+    app.before_request(_check_not_modified)
+    app.after_request(_finish_response)
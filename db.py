@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+
+from flask import g
+
+import metrics
+import pg
+
+# Конфигурация БД: путь к файлу SQLite или URL PostgreSQL (postgres://...)
+DATABASE = os.environ.get('DATABASE_URL', 'gvsu.db')
+
+# Настройки соединения (размеры в байтах / KiB, см. документацию SQLite)
+SQLITE_TIMEOUT = float(os.environ.get('SQLITE_TIMEOUT', 5.0))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16 * 1024))
+SQLITE_CACHED_STATEMENTS = int(os.environ.get('SQLITE_CACHED_STATEMENTS', 256))
+
+# Соединения SQLite переиспользуются в пределах потока воркера
+_pool = threading.local()
+
+
+def is_postgres_url(database):
+    return database.startswith(('postgres://', 'postgresql://'))
+
+
+def is_postgres(conn):
+    return isinstance(conn, pg.Connection)
+
+
+# Исключения обоих бэкендов - для except в коде приложения
+if is_postgres_url(DATABASE):
+    Error = (sqlite3.Error, pg.driver().Error)
+    IntegrityError = (sqlite3.IntegrityError, pg.driver().IntegrityError)
+    OperationalError = (sqlite3.OperationalError, pg.driver().OperationalError)
+else:
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+    OperationalError = sqlite3.OperationalError
+
+
+def connect(database=None):
+    """Открыть новое соединение с БД (для SQLite - с прагмами)"""
+    database = database or DATABASE
+    if is_postgres_url(database):
+        return pg.connect(database)
+    conn = sqlite3.connect(database,
+                           timeout=SQLITE_TIMEOUT,
+                           cached_statements=SQLITE_CACHED_STATEMENTS,
+                           factory=metrics.Connection)
+    conn.row_factory = sqlite3.Row
+    # Новая БД создается с инкрементальной очисткой (см. maintenance.py): режим
+    # задается до первой записи в файл, у существующей БД его меняет только VACUUM
+    if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE:d}')
+    conn.execute(f'PRAGMA cache_size = {-SQLITE_CACHE_SIZE_KB:d}')
+    return conn
+
+
+def _acquire():
+    """Взять соединение текущего потока, при необходимости создать новое"""
+    if is_postgres_url(DATABASE):
+        return pg.pool(DATABASE).acquire()
+    conn = getattr(_pool, 'conn', None)
+    # После fork соединение родителя использовать нельзя
+    if conn is not None and getattr(_pool, 'pid', None) != os.getpid():
+        conn = None
+    if conn is None:
+        conn = connect()
+        _pool.conn = conn
+        _pool.pid = os.getpid()
+    return conn
+
+
+def _release(conn):
+    """Вернуть соединение в пул в чистом состоянии"""
+    if is_postgres(conn):
+        pg.pool(DATABASE).release(conn)
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        # Соединение испорчено - закрываем, следующий запрос откроет новое
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        _pool.conn = None
+
+
+def get_db():
+    """Получить соединение с БД, привязанное к контексту приложения"""
+    if 'db' not in g:
+        g.db = _acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    """Вернуть соединение в пул по завершении контекста"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        _release(conn)
+
+
+def close_pool():
+    """Закрыть соединения текущего процесса/потока (например, перед fork)"""
+    if is_postgres_url(DATABASE):
+        pg.pool(DATABASE).close()
+        return
+    conn = getattr(_pool, 'conn', None)
+    _pool.conn = None
+    if conn is not None:
+        conn.close()
+
+
+def begin_write(conn):
+    """Начать транзакцию записи.
+
+    В SQLite блокировка записи берется сразу (BEGIN IMMEDIATE), чтобы
+    ожидание другого писателя случилось до выполнения запросов; в PostgreSQL
+    транзакцию открывает драйвер при первом запросе.
+    """
+    if not is_postgres(conn):
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def insert(conn, sql, params=()):
+    """Выполнить INSERT и вернуть id новой строки"""
+    if is_postgres(conn):
+        return conn.execute(sql + ' RETURNING id', params).fetchone()[0]
+    return conn.execute(sql, params).lastrowid
+
+
+def timestamp_sql(conn):
+    """SQL-выражение текущего времени UTC в текстовом формате SQLite (ГГГГ-ММ-ДД ЧЧ:ММ:СС)"""
+    if is_postgres(conn):
+        return "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+    return 'CURRENT_TIMESTAMP'
+
+
+# Ошибки, после которых транзакцию имеет смысл повторить: в SQLite - БД
+# занята, в PostgreSQL - конфликт сериализации, взаимоблокировка, блокировка
+_RETRY_SQLITE = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+_RETRY_SQLSTATE = ('40001', '40P01', '55P03')
+
+
+def is_retryable(error):
+    """Ошибка вызвана конкурентным доступом, а не самим запросом"""
+    if isinstance(error, sqlite3.Error):
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xff in _RETRY_SQLITE
+        return 'locked' in str(error) or 'busy' in str(error)
+    sqlstate = getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None)
+    return sqlstate in _RETRY_SQLSTATE
+
+
+def init_app(app):
+    """Подключить управление соединениями к приложению"""
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,53 @@
+"""Конфигурация gunicorn для продакшена.
+
+Приложение загружается один раз в мастере (preload_app): миграции БД,
+сборка статики и прогрев шаблонов выполняются до fork, воркеры получают
+готовый процесс. Соединения с БД создаются в воркерах по одному на поток
+(db.py), поэтому режим gthread безопасен.
+
+Все параметры можно переопределить переменными окружения или ключами
+командной строки gunicorn.
+"""
+import multiprocessing
+import os
+
+import db
+import metrics
+
+cores = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# SQLite сериализует запись, поэтому процессов - по числу ядер (не 2n+1),
+# а ожидание ввода-вывода перекрывается потоками
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, cores)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+
+preload_app = True
+
+# Перезапуск воркеров после N запросов (со случайным разбросом, чтобы не все сразу)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Пустое значение отключает журнал доступа
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+
+
+def on_starting(server):
+    # Счетчики прошлого запуска сервера не нужны
+    metrics.clear_dir()
+
+
+def pre_fork(server, worker):
+    # Соединение, открытое в мастере при загрузке приложения, воркерам не передаем
+    db.close_pool()
+
+
+def worker_exit(server, worker):
+    # Сохранить метрики воркера, перезапускаемого по max_requests
+    metrics.flush()
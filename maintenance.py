@@ -0,0 +1,308 @@
+"""Фоновое обслуживание БД SQLite.
+
+Раз в MAINTENANCE_INTERVAL секунд (0 - отключено) один из воркеров
+обслуживает БД:
+
+- удаление осиротевших протоколов, чьи дела или авторы удалены (внешние
+  ключи в SQLite не включены, а delete_case/delete_user протоколы не
+  трогают); удаляются пачками по MAINTENANCE_BATCH_SIZE вместе с записями
+  поиска, каждая пачка - отдельной короткой транзакцией;
+- слияние сегментов полнотекстовых индексов FTS5 (удаленные строки
+  остаются в них, пока сегменты не слиты): инкрементальное, шагами по
+  MAINTENANCE_MERGE_PAGES страниц, и только в таблицах, данные которых
+  изменились с прошлого полного слияния;
+- PRAGMA optimize: ANALYZE тех таблиц, статистика которых устарела;
+- PRAGMA incremental_vacuum: возврат свободных страниц файлу (не больше
+  MAINTENANCE_VACUUM_PAGES за раз);
+- контрольная точка WAL: PASSIVE, а если журнал перенесен целиком -
+  TRUNCATE, чтобы файл -wal не рос.
+
+Инкрементальная очистка требует auto_vacuum = INCREMENTAL (так создаются
+новые БД). В базе, созданной без него, очистка пропускается: режим меняется
+только полным VACUUM, на время которого запись в БД ждет, поэтому он
+включается явно, в удобное время, командой
+flask --app app maintenance --enable-incremental.
+
+Обслуживание выполняется под блокировкой файла MAINTENANCE_LOCK, в котором
+хранятся время последнего запуска и версии данных слитых индексов (JSON):
+воркеры пробуют взять ее раз в интервал,
+и обслуживает тот, кто взял ее первым после истечения интервала. Команда
+flask maintenance берет ту же блокировку (ждет, если обслуживание уже идет).
+Длительность и освобожденное место пишутся в лог gvsu.maintenance и в
+метрики.
+
+PostgreSQL обслуживает себя сам (autovacuum), для него планировщик не
+запускается.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import db
+import metrics
+from cache import table_versions
+from migrations import SEARCH_INDEXES, unindex_search
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAINTENANCE_INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL', 3600))
+MAINTENANCE_LOCK = os.environ.get('MAINTENANCE_LOCK') or db.DATABASE + '.maintenance.lock'
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get('MAINTENANCE_VACUUM_PAGES', 10000))
+MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', 500))
+# Страниц индекса FTS5 на один шаг слияния (одна транзакция) и на весь запуск
+MAINTENANCE_MERGE_PAGES = int(os.environ.get('MAINTENANCE_MERGE_PAGES', 100))
+MAINTENANCE_MERGE_BUDGET = int(os.environ.get('MAINTENANCE_MERGE_BUDGET', 10000))
+# Сколько строк просматривает ANALYZE в каждом индексе (0 - без ограничения)
+MAINTENANCE_ANALYSIS_LIMIT = int(os.environ.get('MAINTENANCE_ANALYSIS_LIMIT', 1000))
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+logger = logging.getLogger('gvsu.maintenance')
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def database_size(database=None):
+    """Размер файла БД вместе с журналом WAL, байт"""
+    database = database or db.DATABASE
+    return _file_size(database) + _file_size(database + '-wal')
+
+
+def delete_orphans(conn, batch_size=MAINTENANCE_BATCH_SIZE):
+    """Удалить протоколы без дела или автора; вернуть число удаленных"""
+    total = 0
+    while True:
+        db.begin_write(conn)
+        try:
+            ids = [row[0] for row in conn.execute('''
+                SELECT p.id FROM protocols p
+                WHERE NOT EXISTS (SELECT 1 FROM cases c WHERE c.id = p.case_id)
+                   OR NOT EXISTS (SELECT 1 FROM users u WHERE u.id = p.user_id)
+                LIMIT ?
+            ''', (batch_size,))]
+            if ids:
+                where = f'id IN ({", ".join("?" * len(ids))})'
+                # Поиск по протоколам ведет приложение - записи убираются до удаления
+                unindex_search(conn, 'protocols', where, ids)
+                conn.execute(f'DELETE FROM protocols WHERE {where}', ids)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+
+
+def _merge_step(conn, table, pages):
+    """Один шаг слияния индекса table; вернуть True, если слияние завершено"""
+    db.begin_write(conn)
+    try:
+        before = conn.total_changes
+        # Как automerge: сливаются сегменты одного уровня, не больше pages страниц за шаг,
+        # а не весь индекс, как 'optimize'
+        conn.execute(f"INSERT INTO {table}_fts ({table}_fts, rank) VALUES ('merge', ?)", (pages,))
+        done = conn.total_changes - before < 2
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return done
+
+
+def merge_search_indexes(conn, merged, pages=MAINTENANCE_MERGE_PAGES, budget=MAINTENANCE_MERGE_BUDGET):
+    """Слить сегменты индексов FTS5, убрав из них удаленные строки; вернуть число шагов.
+
+    merged - {таблица: версия данных при последнем полном слиянии}; таблицы,
+    данные которых с тех пор не менялись, пропускаются. Словарь обновляется
+    для таблиц, слияние которых завершено за этот запуск.
+    """
+    tables = tuple(SEARCH_INDEXES)
+    steps = 0
+    for table, version in zip(tables, table_versions(conn, tables)):
+        if merged.get(table) == version:
+            continue
+        while steps * pages < budget:
+            steps += 1
+            if _merge_step(conn, table, pages):
+                merged[table] = version
+                break
+    return steps
+
+
+def optimize(conn):
+    """Обновить статистику планировщика там, где она устарела"""
+    conn.execute(f'PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT:d}')
+    # Без статистики optimize ничего не анализирует - первый раз ANALYZE целиком
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        conn.execute('ANALYZE')
+    conn.execute('PRAGMA optimize')
+
+
+def incremental(conn):
+    """Включен ли режим auto_vacuum = INCREMENTAL"""
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+
+
+def enable_incremental(conn):
+    """Включить auto_vacuum = INCREMENTAL полным VACUUM; вернуть число освобожденных страниц"""
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL:d}')
+    # Режим auto_vacuum меняется только полным VACUUM
+    conn.execute('VACUUM')
+    return free
+
+
+def vacuum(conn, pages=MAINTENANCE_VACUUM_PAGES):
+    """Вернуть файлу свободные страницы; вернуть число освобожденных страниц"""
+    if not incremental(conn):
+        return 0
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # incremental_vacuum возвращает строку на каждую страницу - их нужно выбрать
+    conn.execute(f'PRAGMA incremental_vacuum({pages:d})').fetchall()
+    return free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def checkpoint(conn):
+    """Перенести журнал WAL в БД; вернуть (страниц в журнале, перенесено)"""
+    busy, log, done = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    if not busy and log == done and log > 0:
+        # Все перенесено - обрезка файла журнала почти ничего не стоит
+        busy, log, done = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    return log, done
+
+
+def run(database=None, enable=False, merged=None):
+    """Выполнить все шаги обслуживания; вернуть отчет (dict).
+
+    enable - сначала включить инкрементальную очистку (полный VACUUM), если
+    она выключена; merged - см. merge_search_indexes.
+    """
+    database = database or db.DATABASE
+    started = time.perf_counter()
+    size_before = database_size(database)
+    conn = db.connect(database)
+    conn.isolation_level = None
+    try:
+        report = {'orphans': delete_orphans(conn), 'vacuumed_pages': 0}
+        if enable and not incremental(conn):
+            report['vacuumed_pages'] = enable_incremental(conn)
+        report['merge_steps'] = merge_search_indexes(conn, {} if merged is None else merged)
+        optimize(conn)
+        report['incremental'] = incremental(conn)
+        report['vacuumed_pages'] += vacuum(conn)
+        report['wal_pages'], report['checkpointed_pages'] = checkpoint(conn)
+    finally:
+        conn.close()
+    report['seconds'] = time.perf_counter() - started
+    report['reclaimed_bytes'] = max(0, size_before - database_size(database))
+    return report
+
+
+def run_locked(wait=True, interval=0, **kwargs):
+    """run() под блокировкой MAINTENANCE_LOCK.
+
+    Без ожидания (wait=False) вернуть None, если блокировка занята; так же -
+    если с прошлого запуска прошло меньше interval секунд. Состояние между
+    запусками (время, версии слитых индексов) хранится в файле блокировки.
+    """
+    if fcntl is None:
+        return run(**kwargs)
+    with open(MAINTENANCE_LOCK, 'a+') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return None
+        state = _load_state(f)
+        now = time.time()
+        if interval and now - state.get('last_run', 0) < interval:
+            return None
+        state['last_run'] = now
+        _save_state(f, state)
+        # Версии слитых индексов сохраняются и после сбоя на одном из шагов;
+        # блокировка снимается при закрытии файла
+        try:
+            return run(merged=state['merged'], **kwargs)
+        finally:
+            _save_state(f, state)
+
+
+def _load_state(f):
+    f.seek(0)
+    try:
+        state = json.loads(f.read())
+    except ValueError:
+        state = None
+    if not isinstance(state, dict) or not isinstance(state.get('merged'), dict):
+        state = {'last_run': 0, 'merged': {}}
+    return state
+
+
+def _save_state(f, state):
+    f.seek(0)
+    f.truncate()
+    f.write(json.dumps(state) + '\n')
+    f.flush()
+
+
+def _run_logged():
+    try:
+        report = run_locked(wait=False, interval=MAINTENANCE_INTERVAL)
+    except Exception:
+        metrics.registry.inc('gvsu_maintenance_runs_total', {'status': 'error'})
+        logger.exception('Обслуживание БД не выполнено')
+        return
+    if report is None:
+        return
+    metrics.registry.inc('gvsu_maintenance_runs_total', {'status': 'ok'})
+    metrics.registry.observe('gvsu_maintenance_duration_seconds', {}, report['seconds'])
+    metrics.registry.inc('gvsu_maintenance_reclaimed_bytes_total', {}, report['reclaimed_bytes'])
+    logger.info('Обслуживание БД за %.2f с: освобождено %d байт, удалено протоколов-сирот: %d, '
+                'шагов слияния индексов: %d, страниц очищено: %d, WAL: %d/%d',
+                report['seconds'], report['reclaimed_bytes'], report['orphans'], report['merge_steps'],
+                report['vacuumed_pages'], report['checkpointed_pages'], report['wal_pages'])
+    if not report['incremental']:
+        logger.warning('Инкрементальная очистка выключена, свободные страницы не возвращаются; '
+                       'включите ее: flask --app app maintenance --enable-incremental')
+
+
+class Scheduler:
+    """Поток обслуживания текущего процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _loop(self):
+        while True:
+            time.sleep(MAINTENANCE_INTERVAL)
+            _run_logged()
+
+    def ensure_started(self):
+        # После fork поток родителя в дочернем процессе не существует
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                threading.Thread(target=self._loop, name='db-maintenance', daemon=True).start()
+                self.pid = os.getpid()
+
+
+scheduler = Scheduler()
+
+
+def init_app(app):
+    """Запускать обслуживание в фоне (SQLite, если интервал задан)"""
+    if not MAINTENANCE_INTERVAL or fcntl is None or db.is_postgres_url(db.DATABASE):
+        return
+    app.before_request(scheduler.ensure_started)
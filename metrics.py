@@ -0,0 +1,346 @@
+"""Метрики запросов и SQL в формате Prometheus.
+
+На каждый HTTP-запрос считается общее время (гистограмма по endpoint), время
+в SQLite (выполнение и выборка строк, COMMIT) и время рендеринга шаблонов, а
+также число SQL-запросов. Запросы дольше SLOW_QUERY_MS пишутся в лог
+gvsu.sql вместе с текстом и параметрами.
+
+Каждый воркер держит счетчики в памяти и не чаще раза в
+METRICS_FLUSH_INTERVAL секунд сбрасывает их в свой файл в METRICS_DIR.
+/admin/metrics складывает файлы всех воркеров. Файлы завершившихся воркеров
+остаются, чтобы счетчики не уменьшались; каталог очищается при старте
+сервера (clear_dir).
+"""
+import bisect
+import glob
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, abort, g, request, session
+from flask.signals import before_render_template, template_rendered
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'gvsu-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Токен для сборщика метрик (Authorization: Bearer ...), вход администратора не нужен
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+MAINTENANCE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+# Описание метрик: имя -> (тип, описание, границы гистограммы)
+METRICS = {
+    'gvsu_http_requests_total': (
+        'counter', 'HTTP-запросы по endpoint, методу и статусу', None),
+    'gvsu_http_request_duration_seconds': (
+        'histogram', 'Время обработки HTTP-запроса', REQUEST_BUCKETS),
+    'gvsu_http_request_db_seconds_total': (
+        'counter', 'Время в SQLite за время HTTP-запросов', None),
+    'gvsu_http_request_template_seconds_total': (
+        'counter', 'Время рендеринга шаблонов за время HTTP-запросов', None),
+    'gvsu_db_statements_total': (
+        'counter', 'Выполненные SQL-запросы по endpoint', None),
+    'gvsu_db_statement_duration_seconds': (
+        'histogram', 'Время выполнения SQL-запроса', STATEMENT_BUCKETS),
+    'gvsu_db_slow_statements_total': (
+        'counter', f'SQL-запросы дольше {SLOW_QUERY_MS:g} мс', None),
+    'gvsu_maintenance_runs_total': (
+        'counter', 'Запуски обслуживания БД по результату', None),
+    'gvsu_maintenance_duration_seconds': (
+        'histogram', 'Время обслуживания БД', MAINTENANCE_BUCKETS),
+    'gvsu_maintenance_reclaimed_bytes_total': (
+        'counter', 'Место, освобожденное обслуживанием БД', None),
+}
+
+logger = logging.getLogger('gvsu.sql')
+
+
+class Registry:
+    """Счетчики и гистограммы одного процесса.
+
+    Значения хранятся как {метрика: {ключ меток: значение}}, где ключ - JSON
+    списка пар (метка, значение); у гистограммы значение - список
+    [счетчики корзин..., сумма, количество].
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    @staticmethod
+    def key(labels):
+        return _label_key(tuple(sorted(labels.items())))
+
+    def inc(self, name, labels, value=1):
+        key = self.key(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = self.key(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * (len(buckets) + 2)
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {name: {key: list(v) if isinstance(v, list) else v for key, v in series.items()}
+                    for name, series in self.values.items()}
+
+
+@lru_cache(maxsize=4096)
+def _label_key(pairs):
+    return json.dumps(pairs, ensure_ascii=False)
+
+
+registry = Registry()
+_local = threading.local()
+_last_flush = 0.0
+
+
+def _endpoint():
+    return getattr(_local, 'endpoint', None) or '-'
+
+
+def record_statement(sql, parameters, elapsed):
+    """Учесть выполненный SQL-запрос (вызывается обертками соединений)"""
+    registry.inc('gvsu_db_statements_total', {'endpoint': _endpoint()})
+    registry.observe('gvsu_db_statement_duration_seconds', {}, elapsed)
+    add_db_time(elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        registry.inc('gvsu_db_slow_statements_total', {'endpoint': _endpoint()})
+        # Значения параметров (пароли, тексты протоколов) в лог не пишутся
+        logger.warning('Медленный запрос (%.1f мс, %s): %s [%s]', elapsed * 1000, _endpoint(),
+                       ' '.join(sql.split()), _describe_parameters(parameters))
+
+
+def _describe_parameters(parameters):
+    if isinstance(parameters, str):
+        return parameters
+    return f'параметров: {len(parameters) if parameters else 0}'
+
+
+def add_db_time(elapsed):
+    """Добавить время работы с БД (выборка строк, COMMIT) к текущему запросу"""
+    if getattr(_local, 'endpoint', None) is not None:
+        _local.db_seconds += elapsed
+
+
+class Cursor(sqlite3.Cursor):
+    """Курсор, замеряющий выполнение и выборку строк"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_statement(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_statement(sql, '<executemany>', time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_db_time(time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            add_db_time(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_db_time(time.perf_counter() - started)
+
+
+class Connection(sqlite3.Connection):
+    """Соединение, все запросы которого идут через замеряющий курсор"""
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            add_db_time(time.perf_counter() - started)
+
+
+def _start_request():
+    _local.endpoint = request.endpoint or 'unknown'
+    _local.db_seconds = 0.0
+    _local.template_seconds = 0.0
+    _local.render_started = []
+    g.metrics_started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = _local.endpoint
+    registry.inc('gvsu_http_requests_total',
+                 {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+    registry.observe('gvsu_http_request_duration_seconds', {'endpoint': endpoint}, elapsed)
+    registry.inc('gvsu_http_request_db_seconds_total', {'endpoint': endpoint}, _local.db_seconds)
+    registry.inc('gvsu_http_request_template_seconds_total', {'endpoint': endpoint},
+                 _local.template_seconds)
+    if time.monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL:
+        flush()
+    return response
+
+
+def _end_request(exc=None):
+    # SQL вне запросов (миграции, фоновые задачи) не относится к endpoint
+    _local.endpoint = None
+
+
+def _before_render(sender, template, context, **extra):
+    stack = getattr(_local, 'render_started', None)
+    if stack is not None:
+        stack.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stack = getattr(_local, 'render_started', None)
+    if stack:
+        elapsed = time.perf_counter() - stack.pop()
+        # render_template, вызванный во время рендеринга, не считается дважды
+        if not stack:
+            _local.template_seconds += elapsed
+
+
+def _path(pid=None):
+    return os.path.join(METRICS_DIR, f'{pid or os.getpid()}.json')
+
+
+def flush():
+    """Сбросить метрики процесса в его файл"""
+    global _last_flush
+    _last_flush = time.monotonic()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _path()
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(registry.snapshot(), f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def clear_dir():
+    """Удалить файлы метрик прошлых запусков (вызывается при старте сервера)"""
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def collect():
+    """Сложить метрики всех воркеров"""
+    flush()
+    total = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                values = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in values.items():
+            merged = total.setdefault(name, {})
+            for key, value in series.items():
+                if isinstance(value, list):
+                    current = merged.setdefault(key, [0] * len(value))
+                    merged[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    # Целые счетчики - без экспоненты (1e+06 у :g), дробные - без потери точности
+    return f'{value:d}' if isinstance(value, int) else repr(float(value))
+
+
+def render(values):
+    """Текстовый формат Prometheus"""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for key, value in sorted(values.get(name, {}).items()):
+            pairs = [tuple(pair) for pair in json.loads(key)]
+            if kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(pairs + [("le", f"{bound:g}")])} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(pairs + [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{_labels(pairs)} {_number(value[-2])}')
+                lines.append(f'{name}_count{_labels(pairs)} {value[-1]}')
+            else:
+                lines.append(f'{name}{_labels(pairs)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    """Метрики всех воркеров (администратор или METRICS_TOKEN)"""
+    token = request.headers.get('Authorization', '')
+    if not session.get('admin') and not (METRICS_TOKEN and token == f'Bearer {METRICS_TOKEN}'):
+        abort(403)
+    return Response(render(collect()), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    """Подключить сбор метрик к приложению"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.add_url_rule('/admin/metrics', 'admin_metrics', metrics_view)
@@ -0,0 +1,639 @@
+"""Версионированные миграции схемы БД.
+
+Текущая версия схемы хранится в PRAGMA user_version (в PostgreSQL - в
+таблице schema_version). Миграции применяются по порядку внутри одной
+транзакции, которая одновременно служит блокировкой между воркерами и
+узлами: в SQLite это BEGIN IMMEDIATE, в PostgreSQL - advisory lock. Пока
+один процесс мигрирует, остальные ждут и затем видят уже обновленную версию.
+
+Миграции пишутся на диалекте SQLite; различия в DDL (AUTOINCREMENT,
+WITHOUT ROWID, CURRENT_TIMESTAMP) переводит _ddl, а триггеры и
+полнотекстовый поиск для PostgreSQL описаны отдельно.
+"""
+import db
+from compression import PACKED_COLUMNS, unpack_text
+
+MIGRATIONS = []
+
+# Ключ advisory lock миграций в PostgreSQL (произвольная константа)
+PG_MIGRATION_LOCK = 0x67767375
+
+
+def migration(version):
+    """Зарегистрировать функцию миграции схемы до версии version"""
+    def decorator(func):
+        MIGRATIONS.append((version, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    if db.is_postgres(conn):
+        if conn.execute("SELECT to_regclass('schema_version')").fetchone()[0] is None:
+            return 0
+        row = conn.execute('SELECT version FROM schema_version').fetchone()
+        return row[0] if row else 0
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _lock(conn):
+    """Начать транзакцию миграций и взять блокировку между процессами"""
+    if db.is_postgres(conn):
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (PG_MIGRATION_LOCK,))
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def _set_version(conn, version):
+    if db.is_postgres(conn):
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+    else:
+        conn.execute(f'PRAGMA user_version = {version:d}')
+
+
+def migrate(database=None):
+    """Применить недостающие миграции. Возвращает список примененных версий"""
+    conn = db.connect(database)
+    if not db.is_postgres(conn):
+        conn.isolation_level = None
+    try:
+        # Быстрый путь: схема актуальна, блокировка не нужна
+        if current_version(conn) >= latest_version():
+            return []
+
+        _lock(conn)
+        try:
+            # Версию перечитываем под блокировкой - ее мог поднять другой воркер
+            version = current_version(conn)
+            applied = []
+            for target, func in MIGRATIONS:
+                if target <= version:
+                    continue
+                func(conn)
+                _set_version(conn, target)
+                applied.append(target)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return applied
+    finally:
+        conn.close()
+
+
+def _columns(conn, table):
+    if db.is_postgres(conn):
+        rows = conn.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = ?
+        ''', (table,))
+        return {row[0] for row in rows}
+    return {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _ddl(conn, sql):
+    """Выполнить DDL, написанный для SQLite, в диалекте текущей БД"""
+    if db.is_postgres(conn):
+        sql = sql.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+        sql = sql.replace('DEFAULT CURRENT_TIMESTAMP', f'DEFAULT ({db.timestamp_sql(conn)})')
+        sql = sql.replace(') WITHOUT ROWID', ')')
+    conn.execute(sql)
+
+
+def _pg_trigger(conn, name, table, when, body, level='ROW'):
+    """Триггер PostgreSQL: функция plpgsql с телом body и сам триггер.
+
+    when - момент и события, например 'AFTER INSERT OR DELETE'; тело само
+    завершается RETURN.
+    """
+    conn.execute(f'''
+        CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            {body}
+        END
+        $$
+    ''')
+    conn.execute(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+    conn.execute(f'CREATE TRIGGER {name} {when} ON {table} FOR EACH {level} EXECUTE FUNCTION {name}()')
+
+
+@migration(1)
+def create_base_schema(conn):
+    """Исходная схема: новости, пользователи, сотрудники, дела, протоколы, админы"""
+    # Таблица новостей
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS news (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            date TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица пользователей (регистрация)
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            experience TEXT,
+            education TEXT,
+            rank TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Добавить поле status если его нет (для существующих БД)
+    if 'status' not in _columns(conn, 'users'):
+        conn.execute("ALTER TABLE users ADD COLUMN status TEXT DEFAULT 'pending'")
+
+    # Таблица сотрудников
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            position TEXT NOT NULL,
+            department TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица дел
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS cases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            case_number TEXT,
+            assigned_to INTEGER,
+            status TEXT DEFAULT 'open',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (assigned_to) REFERENCES employees(id)
+        )
+    ''')
+
+    # Таблица протоколов
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS protocols (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            case_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            protocol_number TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (case_id) REFERENCES cases(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # Таблица админов
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL
+        )
+    ''')
+
+    # Создать дефолтного админа, если его нет
+    if conn.execute('SELECT 1 FROM admins LIMIT 1').fetchone() is None:
+        conn.execute('INSERT INTO admins (username, password) VALUES (?, ?)',
+                     ('admin', 'admin123'))
+
+
+@migration(2)
+def add_listing_indexes(conn):
+    """Индексы под фильтры и сортировки списков"""
+    # Главная страница: последние новости
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_news_date ON news (date)')
+
+    # Список пользователей и фильтр по статусу (очередь заявок)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_status_created_at ON users (status, created_at)')
+
+    # Сотрудники: список по дате и выпадающий список по ФИО
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_created_at ON employees (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_full_name ON employees (full_name)')
+
+    # Дела: список по дате, фильтр по статусу, дела сотрудника
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_created_at ON cases (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_status_created_at ON cases (status, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_assigned_to ON cases (assigned_to)')
+
+    # Протоколы: все протоколы, протоколы пользователя и протоколы дела
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_protocols_created_at ON protocols (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_protocols_user_created_at ON protocols (user_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_protocols_case_created_at ON protocols (case_id, created_at)')
+
+    conn.execute('ANALYZE')
+
+
+# Таблицы со счетчиками строк и колонка статуса для счетчиков по статусам
+COUNTED_TABLES = {
+    'news': None,
+    'users': 'status',
+    'employees': None,
+    'cases': 'status',
+    'protocols': None,
+}
+
+
+def _bump(key_sql, delta):
+    """Тело триггера: изменить счетчик key_sql на delta (upsert)"""
+    return (f'INSERT INTO stats (key, value) VALUES ({key_sql}, {delta:d}) '
+            f'ON CONFLICT (key) DO UPDATE SET value = stats.value + {delta:d};')
+
+
+def backfill_stats(conn):
+    """Пересчитать таблицу stats по текущим данным"""
+    conn.execute('DELETE FROM stats')
+    for table, status_column in COUNTED_TABLES.items():
+        conn.execute(f"INSERT INTO stats (key, value) SELECT '{table}', COUNT(*) FROM {table}")
+        if status_column:
+            conn.execute(f'''
+                INSERT INTO stats (key, value)
+                SELECT '{table}:' || COALESCE({status_column}, ''), COUNT(*)
+                FROM {table} GROUP BY {status_column}
+            ''')
+
+
+def _add_pg_stats_triggers(conn, table, status_column):
+    """Триггеры счетчиков stats для PostgreSQL"""
+    on_insert = [_bump(f"'{table}'", 1)]
+    on_delete = [_bump(f"'{table}'", -1)]
+    if status_column:
+        on_insert.append(_bump(f"'{table}:' || COALESCE(NEW.{status_column}, '')", 1))
+        on_delete.append(_bump(f"'{table}:' || COALESCE(OLD.{status_column}, '')", -1))
+        _pg_trigger(conn, f'trg_{table}_stats_update', table, f'AFTER UPDATE OF {status_column}', f'''
+            IF OLD.{status_column} IS DISTINCT FROM NEW.{status_column} THEN
+                {_bump(f"'{table}:' || COALESCE(OLD.{status_column}, '')", -1)}
+                {_bump(f"'{table}:' || COALESCE(NEW.{status_column}, '')", 1)}
+            END IF;
+            RETURN NULL;''')
+    _pg_trigger(conn, f'trg_{table}_stats_insert', table, 'AFTER INSERT',
+                f"{' '.join(on_insert)} RETURN NULL;")
+    _pg_trigger(conn, f'trg_{table}_stats_delete', table, 'AFTER DELETE',
+                f"{' '.join(on_delete)} RETURN NULL;")
+
+
+@migration(3)
+def add_stats_counters(conn):
+    """Счетчики строк для дашборда, поддерживаемые триггерами"""
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS stats (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    for table, status_column in COUNTED_TABLES.items():
+        if db.is_postgres(conn):
+            _add_pg_stats_triggers(conn, table, status_column)
+            continue
+        on_insert = [_bump(f"'{table}'", 1)]
+        on_delete = [_bump(f"'{table}'", -1)]
+        if status_column:
+            on_insert.append(_bump(f"'{table}:' || COALESCE(NEW.{status_column}, '')", 1))
+            on_delete.append(_bump(f"'{table}:' || COALESCE(OLD.{status_column}, '')", -1))
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_update
+                AFTER UPDATE OF {status_column} ON {table}
+                WHEN OLD.{status_column} IS NOT NEW.{status_column}
+                BEGIN
+                    {_bump(f"'{table}:' || COALESCE(OLD.{status_column}, '')", -1)}
+                    {_bump(f"'{table}:' || COALESCE(NEW.{status_column}, '')", 1)}
+                END
+            ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                {' '.join(on_insert)}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_delete
+            AFTER DELETE ON {table}
+            BEGIN
+                {' '.join(on_delete)}
+            END
+        ''')
+
+    backfill_stats(conn)
+
+
+# Таблицы, для которых ведется счетчик версий данных (сигнал для кешей)
+VERSIONED_TABLES = ('news', 'users', 'employees', 'cases', 'protocols')
+
+
+@migration(4)
+def add_data_versions(conn):
+    """Версии данных таблиц: увеличиваются триггерами при любой записи"""
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in VERSIONED_TABLES:
+        conn.execute('INSERT INTO data_versions (name, version) VALUES (?, 0) '
+                     'ON CONFLICT (name) DO NOTHING', (table,))
+        if db.is_postgres(conn):
+            # Версии достаточно поднять раз на оператор, а не на каждую строку
+            _pg_trigger(conn, f'trg_{table}_version', table, 'AFTER INSERT OR UPDATE OR DELETE', f'''
+                UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                RETURN NULL;''', level='STATEMENT')
+            continue
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+# Полнотекстовые индексы: таблица -> индексируемые колонки
+SEARCH_INDEXES = {
+    'protocols': ('title', 'content', 'protocol_number'),
+    'cases': ('title', 'description', 'case_number'),
+}
+
+
+def search_document(table, alias=None):
+    """Выражение tsvector строки таблицы для PostgreSQL (по нему построен GIN-индекс)"""
+    prefix = f'{alias}.' if alias else ''
+    text = " || ' ' || ".join(f"COALESCE({prefix}{col}, '')" for col in SEARCH_INDEXES[table])
+    return f"to_tsvector('simple', {text})"
+
+
+def rebuild_search(conn):
+    """Перестроить полнотекстовые индексы по текущим данным"""
+    if db.is_postgres(conn):
+        # GIN-индекс по выражению поддерживается самим PostgreSQL
+        for table in SEARCH_INDEXES:
+            conn.execute(f'REINDEX INDEX idx_{table}_search')
+        return
+    for table in SEARCH_INDEXES:
+        if table in PACKED_COLUMNS:
+            # Индекс без собственного текста заполняет приложение (см. index_search)
+            conn.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('delete-all')")
+            index_search(conn, table)
+        else:
+            conn.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def _create_fts(conn, table, columns):
+    """Индекс FTS5 по колонкам columns таблицы table и триггеры его обновления"""
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{col}' for col in columns)
+    old_values = ', '.join(f'OLD.{col}' for col in columns)
+    # Индекс хранит только токены, текст берется из самой таблицы
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {cols},
+            content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE OF {cols} ON {table}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.id, {new_values});
+        END
+    ''')
+
+
+@migration(5)
+def add_search_indexes(conn):
+    """Полнотекстовый поиск (FTS5, в PostgreSQL - GIN по tsvector) по протоколам и делам"""
+    if db.is_postgres(conn):
+        for table in SEARCH_INDEXES:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_search ON {table} '
+                         f'USING GIN ({search_document(table)})')
+        return
+    for table, columns in SEARCH_INDEXES.items():
+        _create_fts(conn, table, columns)
+    rebuild_search(conn)
+
+
+# Таблицы с отметкой времени последнего изменения (синхронизация через API)
+TIMESTAMPED_TABLES = ('news', 'users', 'employees', 'cases', 'protocols')
+
+
+@migration(6)
+def add_updated_at(conn):
+    """Колонка updated_at и индекс по ней для выборки изменений"""
+    for table in TIMESTAMPED_TABLES:
+        if 'updated_at' not in _columns(conn, table):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN updated_at TEXT')
+        conn.execute(f'UPDATE {table} SET updated_at = COALESCE(created_at, {db.timestamp_sql(conn)}) '
+                     f'WHERE updated_at IS NULL')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)')
+        if db.is_postgres(conn):
+            # В PostgreSQL значение выставляется до записи строки, без повторного UPDATE
+            _pg_trigger(conn, f'trg_{table}_updated_at', table, 'BEFORE INSERT OR UPDATE', f'''
+                IF TG_OP = 'INSERT' AND NEW.updated_at IS NULL THEN
+                    NEW.updated_at := COALESCE(NEW.created_at, {db.timestamp_sql(conn)});
+                ELSIF TG_OP = 'UPDATE' AND NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN
+                    NEW.updated_at := {db.timestamp_sql(conn)};
+                END IF;
+                RETURN NEW;''')
+            continue
+        # ALTER TABLE не допускает DEFAULT CURRENT_TIMESTAMP, поэтому значение ставит триггер
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at_insert
+            AFTER INSERT ON {table}
+            WHEN NEW.updated_at IS NULL
+            BEGIN
+                UPDATE {table} SET updated_at = COALESCE(NEW.created_at, CURRENT_TIMESTAMP)
+                WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at_update
+            AFTER UPDATE ON {table}
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''')
+
+
+# Индексы FTS5 таблиц со сжатыми колонками не хранят текст и обновляются
+# кодом приложения: распаковать текст в триггере можно только SQL-функцией,
+# которой нет у сторонних клиентов (sqlite3 CLI). Запись в обход приложения
+# индекс не обновляет, а 'delete' должен передать ровно те значения, что были
+# проиндексированы, - после такой записи индекс нужно перестроить
+# (flask rebuild-search), иначе следующее изменение строки его испортит.
+SEARCH_CHUNK_SIZE = 1000
+
+
+def _search_rows(conn, table, where, params):
+    """Строки (id, текст колонок) для индекса table, с распакованными колонками"""
+    columns = SEARCH_INDEXES[table]
+    packed = PACKED_COLUMNS.get(table, ())
+    cursor = conn.execute(f'SELECT id, {", ".join(columns)} FROM {table} WHERE {where}', params)
+    while True:
+        rows = cursor.fetchmany(SEARCH_CHUNK_SIZE)
+        if not rows:
+            return
+        yield [(row[0], *(unpack_text(row[i]) if column in packed else row[i]
+                          for i, column in enumerate(columns, start=1)))
+               for row in rows]
+
+
+def index_search(conn, table, where='1 = 1', params=()):
+    """Добавить в поиск строки table, отобранные условием where (после INSERT/UPDATE)"""
+    if db.is_postgres(conn):
+        return
+    cols = ', '.join(SEARCH_INDEXES[table])
+    values = ', '.join('?' * (len(SEARCH_INDEXES[table]) + 1))
+    for rows in _search_rows(conn, table, where, params):
+        conn.executemany(f'INSERT INTO {table}_fts (rowid, {cols}) VALUES ({values})', rows)
+
+
+def unindex_search(conn, table, where, params=()):
+    """Убрать из поиска строки table, отобранные условием where (до DELETE/UPDATE)"""
+    if db.is_postgres(conn):
+        return
+    cols = ', '.join(SEARCH_INDEXES[table])
+    values = ', '.join('?' * (len(SEARCH_INDEXES[table]) + 1))
+    for rows in _search_rows(conn, table, where, params):
+        conn.executemany(f"INSERT INTO {table}_fts ({table}_fts, rowid, {cols}) "
+                         f"VALUES ('delete', {values})", rows)
+
+
+@migration(7)
+def add_packed_protocols(conn):
+    """Сжатые тексты протоколов: индекс поиска без копии текста, его обновляет приложение"""
+    # PostgreSQL сжимает длинный текст сам (TOAST), схема не меняется
+    if db.is_postgres(conn):
+        return
+    for event in ('insert', 'delete', 'update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_protocols_fts_{event}')
+    conn.execute('DROP TABLE IF EXISTS protocols_fts')
+    # Индекс без собственной копии текста (content=''): текст протоколов хранится сжатым
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE protocols_fts USING fts5(
+            {', '.join(SEARCH_INDEXES['protocols'])},
+            content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    index_search(conn, 'protocols')
+
+
+# Сводки для отчетов: таблица -> (колонки, от которых зависят ключи; сводка -> ключ).
+# Ключ - SQL-выражение над строкой {row} (NEW/OLD в триггерах, сама таблица при пересчете)
+SUMMARIES = {
+    'cases': (('status', 'assigned_to'), {
+        'cases_by_status': "COALESCE({row}.status, '')",
+        'cases_by_employee': "COALESCE(CAST({row}.assigned_to AS TEXT), '')",
+        'cases_by_employee_status': "COALESCE(CAST({row}.assigned_to AS TEXT), '') || ':' || COALESCE({row}.status, '')",
+    }),
+    'protocols': (('case_id', 'user_id', 'created_at'), {
+        'protocols_by_case': 'CAST({row}.case_id AS TEXT)',
+        'protocols_by_user': 'CAST({row}.user_id AS TEXT)',
+        'protocols_by_day': "COALESCE(substr({row}.created_at, 1, 10), '')",
+    }),
+}
+
+
+def _bump_summaries(table, row, delta):
+    """Тело триггера: изменить на delta все сводки таблицы table для строки row"""
+    return ' '.join(
+        f"INSERT INTO summaries (name, key, value) VALUES ('{name}', {key.format(row=row)}, {delta:d}) "
+        f'ON CONFLICT (name, key) DO UPDATE SET value = summaries.value + {delta:d};'
+        for name, key in SUMMARIES[table][1].items())
+
+
+def backfill_summaries(conn):
+    """Пересчитать таблицу summaries по текущим данным"""
+    conn.execute('DELETE FROM summaries')
+    for table, (_, keys) in SUMMARIES.items():
+        for name, key in keys.items():
+            key = key.format(row=table)
+            conn.execute(f'''
+                INSERT INTO summaries (name, key, value)
+                SELECT '{name}', {key}, COUNT(*) FROM {table} GROUP BY {key}
+            ''')
+
+
+@migration(8)
+def add_summaries(conn):
+    """Сводки по делам и протоколам для отчетов, поддерживаемые триггерами"""
+    _ddl(conn, '''
+        CREATE TABLE IF NOT EXISTS summaries (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    ''')
+    # Рейтинги ("больше всего протоколов") без сортировки всей сводки
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_summaries_value ON summaries (name, value)')
+
+    for table, (columns, _) in SUMMARIES.items():
+        cols = ', '.join(columns)
+        if db.is_postgres(conn):
+            changed = ' OR '.join(f'OLD.{col} IS DISTINCT FROM NEW.{col}' for col in columns)
+            _pg_trigger(conn, f'trg_{table}_summaries', table, f'AFTER INSERT OR DELETE OR UPDATE OF {cols}', f'''
+                IF TG_OP = 'INSERT' THEN
+                    {_bump_summaries(table, 'NEW', 1)}
+                ELSIF TG_OP = 'DELETE' THEN
+                    {_bump_summaries(table, 'OLD', -1)}
+                ELSIF {changed} THEN
+                    {_bump_summaries(table, 'OLD', -1)}
+                    {_bump_summaries(table, 'NEW', 1)}
+                END IF;
+                RETURN NULL;''')
+            continue
+        changed = ' OR '.join(f'OLD.{col} IS NOT NEW.{col}' for col in columns)
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_summaries_insert AFTER INSERT ON {table}
+            BEGIN
+                {_bump_summaries(table, 'NEW', 1)}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_summaries_delete AFTER DELETE ON {table}
+            BEGIN
+                {_bump_summaries(table, 'OLD', -1)}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_summaries_update AFTER UPDATE OF {cols} ON {table}
+            WHEN {changed}
+            BEGIN
+                {_bump_summaries(table, 'OLD', -1)}
+                {_bump_summaries(table, 'NEW', 1)}
+            END
+        ''')
+
+    backfill_summaries(conn)
@@ -0,0 +1,130 @@
+"""Курсорная (keyset) пагинация списков.
+
+Страница выбирается условием по ключу сортировки (например, created_at, id)
+вместо OFFSET, поэтому стоимость запроса не зависит от номера страницы и
+размера таблицы - при наличии подходящего индекса.
+"""
+import base64
+import binascii
+import json
+import os
+
+from flask import request
+
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+
+def encode_cursor(values):
+    """Упаковать значения ключа сортировки в строку для URL"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Распаковать курсор; при любой ошибке вернуть None (первая страница)"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def page_size():
+    """Размер страницы из параметра per_page с ограничением сверху"""
+    size = request.args.get('per_page', type=int) or PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class Page:
+    """Страница результатов с курсорами на соседние страницы"""
+
+    def __init__(self, items, next_cursor, prev_cursor, prefix=''):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.prefix = prefix
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def _args(self, key, cursor):
+        args = request.args.to_dict()
+        args.pop(self.prefix + 'after', None)
+        args.pop(self.prefix + 'before', None)
+        args[self.prefix + key] = cursor
+        return args
+
+    def next_args(self):
+        """Параметры запроса для следующей (более старой) страницы"""
+        return self._args('after', self.next_cursor)
+
+    def prev_args(self):
+        """Параметры запроса для предыдущей (более новой) страницы"""
+        return self._args('before', self.prev_cursor)
+
+
+def paginate(conn, select, keys, where=(), params=(), prefix='', per_page=None, descending=True):
+    """Выбрать одну страницу запроса select, отсортированного по keys.
+
+    select - запрос без WHERE/ORDER BY/LIMIT, keys - пары
+    (выражение в SQL, имя поля в строке результата), например
+    (('p.created_at', 'created_at'), ('p.id', 'id')). Последний ключ должен
+    быть уникальным. Курсоры берутся из параметров prefix + after/before;
+    "следующая" страница идет дальше в направлении сортировки.
+    """
+    limit = per_page or page_size()
+    after = decode_cursor(request.args.get(prefix + 'after'), len(keys))
+    before = decode_cursor(request.args.get(prefix + 'before'), len(keys))
+
+    forward, backward = ('DESC', '<'), ('ASC', '>')
+    if not descending:
+        forward, backward = backward, forward
+
+    columns = ', '.join(expr for expr, _ in keys)
+    placeholders = ', '.join('?' * len(keys))
+    conditions = list(where)
+    params = list(params)
+    if before is not None:
+        direction, op = backward
+        conditions.append(f'({columns}) {op} ({placeholders})')
+        params.extend(before)
+    else:
+        direction, op = forward
+        if after is not None:
+            conditions.append(f'({columns}) {op} ({placeholders})')
+            params.extend(after)
+
+    sql = select
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY ' + ', '.join(f'{expr} {direction}' for expr, _ in keys)
+    sql += ' LIMIT ?'
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+
+    def cursor(row):
+        return encode_cursor(row[field] for _, field in keys)
+
+    next_cursor = cursor(rows[-1]) if rows and has_next else None
+    prev_cursor = cursor(rows[0]) if rows and has_prev else None
+    return Page(rows, next_cursor, prev_cursor, prefix)
@@ -0,0 +1,307 @@
+"""Бэкенд PostgreSQL: соединения через любой DB-API драйвер и пул.
+
+Соединение оборачивается так, чтобы код приложения работал с ним так же,
+как с sqlite3: conn.execute(sql, params) с плейсхолдерами "?", строки
+результата доступны и по имени колонки, и по индексу. Плейсхолдеры
+переводятся в стиль драйвера (paramstyle), знаки % экранируются.
+
+Драйвер выбирается переменной PG_DRIVER (имя модуля), по умолчанию первый
+установленный из psycopg, psycopg2, pg8000. Соединения берутся из
+ограниченного пула процесса (PG_POOL_SIZE); если все заняты, запрос ждет
+до PG_POOL_TIMEOUT секунд.
+"""
+import importlib
+import os
+import queue
+import re
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import unquote, urlsplit
+
+import metrics
+
+PG_DRIVER = os.environ.get('PG_DRIVER')
+PG_POOL_SIZE = int(os.environ.get('PG_POOL_SIZE', 10))
+PG_POOL_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', 30))
+
+DRIVERS = ('psycopg', 'psycopg2', 'pg8000')
+
+_driver = None
+
+
+def driver():
+    """Модуль DB-API драйвера PostgreSQL"""
+    global _driver
+    if _driver is None:
+        names = (PG_DRIVER,) if PG_DRIVER else DRIVERS
+        for name in names:
+            try:
+                _driver = importlib.import_module(name)
+                break
+            except ImportError:
+                continue
+        else:
+            raise RuntimeError(f'Для DATABASE_URL=postgres://... установите драйвер: {", ".join(names)}')
+    return _driver
+
+
+def _connect_kwargs(url):
+    """Параметры connect() для драйверов, не принимающих URL"""
+    parts = urlsplit(url)
+    kwargs = {'database': unquote(parts.path.lstrip('/')) or 'postgres'}
+    if parts.hostname:
+        kwargs['host'] = parts.hostname
+    if parts.port:
+        kwargs['port'] = parts.port
+    if parts.username:
+        kwargs['user'] = unquote(parts.username)
+    if parts.password:
+        kwargs['password'] = unquote(parts.password)
+    return kwargs
+
+
+# Строковые литералы, идентификаторы в кавычках, плейсхолдеры и знаки процента
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|\?|%")
+
+
+@lru_cache(maxsize=1024)
+def translate(sql, paramstyle):
+    """Перевести запрос с плейсхолдерами "?" в стиль драйвера"""
+    if paramstyle == 'qmark':
+        return sql
+    counter = iter(range(1, 10000))
+
+    def replace(match):
+        token = match.group(0)
+        if token == '?':
+            if paramstyle == 'numeric':
+                return f':{next(counter)}'
+            return '%s'
+        if paramstyle in ('format', 'pyformat'):
+            return token.replace('%', '%%')
+        return token
+
+    return _TOKENS.sub(replace, sql)
+
+
+class Row:
+    """Строка результата: доступ по имени колонки и по индексу, как у sqlite3.Row"""
+
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self._values))
+
+    def __repr__(self):
+        return f'Row({dict(zip(self._index, self._values))!r})'
+
+    def keys(self):
+        return list(self._index)
+
+
+class Cursor:
+    """Курсор драйвера с интерфейсом, который ждет приложение"""
+
+    def __init__(self, raw, paramstyle):
+        self._raw = raw
+        self._paramstyle = paramstyle
+        self._index = None
+
+    def _wrap(self, rows):
+        return [Row(tuple(row), self._index) for row in rows]
+
+    def _describe(self):
+        description = self._raw.description
+        self._index = {d[0]: i for i, d in enumerate(description)} if description else None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            # Без параметров драйвер не разбирает плейсхолдеры - запрос уходит как есть
+            if parameters:
+                self._raw.execute(translate(sql, self._paramstyle), tuple(parameters))
+            else:
+                self._raw.execute(sql)
+        finally:
+            metrics.record_statement(sql, parameters, time.perf_counter() - started)
+        self._describe()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            self._raw.executemany(translate(sql, self._paramstyle),
+                                  [tuple(params) for params in seq_of_parameters])
+        finally:
+            metrics.record_statement(sql, '<executemany>', time.perf_counter() - started)
+        self._describe()
+        return self
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            metrics.add_db_time(time.perf_counter() - started)
+
+    def fetchone(self):
+        row = self._fetch(self._raw.fetchone)
+        return None if row is None else Row(tuple(row), self._index)
+
+    def fetchmany(self, size=None):
+        return self._wrap(self._fetch(self._raw.fetchmany, size or self._raw.arraysize))
+
+    def fetchall(self):
+        return self._wrap(self._fetch(self._raw.fetchall))
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(100)
+            if not rows:
+                return
+            yield from rows
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def lastrowid(self):
+        # В PostgreSQL идентификатор получают через RETURNING (см. db.insert)
+        return None
+
+    def close(self):
+        self._raw.close()
+
+
+class Connection:
+    """Соединение PostgreSQL с методами execute/commit/rollback как у sqlite3"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._paramstyle = driver().paramstyle
+        self.pid = os.getpid()
+
+    def cursor(self):
+        return Cursor(self._raw.cursor(), self._paramstyle)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self._raw.commit()
+        finally:
+            metrics.add_db_time(time.perf_counter() - started)
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        self._raw.close()
+
+
+def connect(url):
+    """Открыть новое соединение (вне пула)"""
+    module = driver()
+    if module.__name__ in ('psycopg', 'psycopg2'):
+        raw = module.connect(url)
+    else:
+        raw = module.connect(**_connect_kwargs(url))
+    return Connection(raw)
+
+
+class PoolTimeout(RuntimeError):
+    """Все соединения пула заняты дольше PG_POOL_TIMEOUT"""
+
+
+class Pool:
+    """Ограниченный пул соединений процесса"""
+
+    def __init__(self, url, size=PG_POOL_SIZE, timeout=PG_POOL_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'Нет свободного соединения с БД за {self.timeout:g} с')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect(self.url)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Вернуть соединение; испорченное соединение закрывается"""
+        try:
+            conn.rollback()
+        except driver().Error:
+            try:
+                conn.close()
+            except driver().Error:
+                pass
+        else:
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.close()
+            except driver().Error:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool(url):
+    """Пул текущего процесса для url (после fork создается новый)"""
+    current = _pools.get(url)
+    if current is None or current.pid != os.getpid():
+        with _pools_lock:
+            current = _pools.get(url)
+            # Соединения родителя не закрываем: это оборвало бы его сессии
+            if current is None or current.pid != os.getpid():
+                current = _pools[url] = Pool(url)
+    return current
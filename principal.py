@@ -0,0 +1,104 @@
+"""Текущий пользователь запроса (g.user).
+
+Перед каждым запросом строка пользователя из session['user_id'] берется из
+небольшого LRU-кеша воркера. Запись помечена версией данных таблицы users
+(data_versions), при которой строка прочитана: пока запись свежее
+PRINCIPAL_REVALIDATE секунд, запросов к БД нет; после этого сверяется версия,
+и строка перечитывается по первичному ключу, только если таблица менялась.
+Обработчики, меняющие пользователя, сбрасывают его запись сразу.
+
+Версия таблицы, а не updated_at строки, выбрана намеренно: updated_at
+хранится с точностью до секунды, и второе изменение в ту же секунду
+(например, одобрение сразу после правки) проверка по нему не заметила бы.
+Сверка строки по updated_at стоила бы того же запроса по первичному ключу,
+что и перечитывание, а лишнее перечитывание после записи в users - один
+такой запрос раз в PRINCIPAL_REVALIDATE секунд.
+
+Если пользователь удален или больше не одобрен, он выходит из системы:
+session['user_id'] удаляется, g.user = None. Поэтому все маршруты и API,
+проверяющие session['user_id'], видят только действующих пользователей.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, session
+
+from cache import table_versions
+from db import get_db
+
+PRINCIPAL_MAXSIZE = int(os.environ.get('PRINCIPAL_MAXSIZE', 1024))
+PRINCIPAL_REVALIDATE = float(os.environ.get('PRINCIPAL_REVALIDATE', 2))
+
+
+class PrincipalCache:
+    """LRU-кеш строк users по id с проверкой версии данных"""
+
+    def __init__(self, maxsize=PRINCIPAL_MAXSIZE, revalidate=PRINCIPAL_REVALIDATE):
+        self.maxsize = maxsize
+        self.revalidate = revalidate
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conn, user_id):
+        """Строка пользователя user_id (None, если его нет)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+        if entry is not None:
+            row, version, checked_at = entry
+            if now - checked_at < self.revalidate:
+                return row
+            versions = table_versions(conn, ('users',))
+            if versions == version:
+                self._store(user_id, (row, version, now))
+                return row
+        else:
+            versions = table_versions(conn, ('users',))
+
+        # Версия читается до строки: изменение между ними заметит следующая проверка
+        row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        self._store(user_id, (row, versions, now))
+        return row
+
+    def _store(self, user_id, entry):
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        """Сбросить записи пользователей user_ids (без аргументов - все)"""
+        with self._lock:
+            if not user_ids:
+                self._entries.clear()
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+
+principals = PrincipalCache()
+
+
+def load_user():
+    """Определить g.user по сессии; недействующего пользователя разлогинить"""
+    g.user = None
+    user_id = session.get('user_id')
+    if user_id is None:
+        return
+    user = principals.get(get_db(), user_id)
+    if user is None or user['status'] != 'approved':
+        session.pop('user_id', None)
+        session.pop('username', None)
+        return
+    if session.get('username') != user['username']:
+        session['username'] = user['username']
+    g.user = user
+
+
+def init_app(app):
+    """Загружать текущего пользователя перед каждым запросом"""
+    app.before_request(load_user)
@@ -0,0 +1,203 @@
+"""Ограничение частоты и сброс нагрузки для входа и регистрации.
+
+POST-запросы к маршрутам из RATE_LIMITS проходят через «ведра токенов»:
+отдельно по IP клиента и по введенному логину. Ведро вмещает capacity
+токенов и полностью наполняется за period секунд; запрос тратит токен, а
+если его нет, получает 429 с Retry-After еще до обращения к основной БД.
+
+Ведро логина (RATE_LIMITS_USERNAME) защищает одну учетную запись от
+перебора пароля с многих адресов, поэтому оно общее для всех IP. Его лимит
+щедрее лимита по IP: с одного адреса раньше срабатывает ведро IP, а
+посторонний, чтобы заблокировать вход известному пользователю, должен
+перебирать пароль с нескольких адресов.
+
+Состояние ведер общее для всех воркеров gunicorn: оно хранится в отдельном
+небольшом файле SQLite (RATE_LIMIT_DATABASE) и меняется одним UPSERT, так
+что основная БД и ее блокировка записи не затрагиваются. Если хранилище
+недоступно, запросы пропускаются (ограничение - защита, а не условие работы).
+
+Лимиты задаются в RATE_LIMITS (по IP) и RATE_LIMITS_USERNAME (по логину)
+как endpoint=capacity/period через запятую, например
+RATE_LIMITS="user_login=10/60,register=3/600"; указанные значения заменяют
+значения по умолчанию, 0/0 отключает лимит маршрута. Ошибочный элемент
+пишется в лог и пропускается.
+
+Сброс нагрузки: если очередь писателя процесса длиннее SHED_QUEUE_DEPTH или
+транзакции записи дольше SHED_LATENCY_MS (см. writer.latency()), эти же
+маршруты сразу отвечают 503 - пусть повторят позже, а остальные страницы
+не замедляются. 0 отключает соответствующую проверку.
+
+IP клиента берется из X-Forwarded-For, если приложение стоит за
+RATE_LIMIT_PROXIES доверенными прокси (1 на Railway - задано в Procfile).
+Если переменная не задана, а запросы приходят с X-Forwarded-For, все
+клиенты выглядят как адрес прокси и делят одни ведра - об этом в лог
+пишется ошибка (один раз на процесс); при прямом доступе без прокси задайте
+RATE_LIMIT_PROXIES=0.
+"""
+import logging
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import Response, request
+
+import writer
+
+RATE_LIMIT_DATABASE = os.environ.get('RATE_LIMIT_DATABASE',
+                                     os.path.join(tempfile.gettempdir(), 'gvsu-ratelimit.db'))
+RATE_LIMIT_PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 0))
+# Не задано вовсе - вероятно, забыто в настройках деплоя
+RATE_LIMIT_PROXIES_UNSET = 'RATE_LIMIT_PROXIES' not in os.environ
+SHED_QUEUE_DEPTH = int(os.environ.get('SHED_QUEUE_DEPTH', 100))
+SHED_LATENCY_MS = float(os.environ.get('SHED_LATENCY_MS', 2000))
+SHED_RETRY_AFTER = 5
+
+# endpoint -> (capacity, period): capacity запросов, восстанавливаются за period секунд
+DEFAULT_LIMITS = {
+    'user_login': (10, 60),
+    'admin_login': (5, 60),
+    'register': (3, 600),
+}
+# Лимиты по логину: одна учетная запись, все адреса вместе
+DEFAULT_USERNAME_LIMITS = {
+    'user_login': (30, 900),
+    'admin_login': (20, 900),
+}
+
+# Доля запросов, после которых удаляются давно полные ведра
+CLEANUP_PROBABILITY = 0.01
+
+logger = logging.getLogger('gvsu.ratelimit')
+
+
+def parse_limits(value, defaults=DEFAULT_LIMITS):
+    """Лимиты из строки вида 'endpoint=capacity/period,...' поверх defaults"""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        endpoint, _, spec = item.partition('=')
+        capacity, _, period = spec.partition('/')
+        try:
+            limits[endpoint.strip()] = (int(capacity), float(period))
+        except ValueError:
+            logger.error('Неверный элемент лимита %r (ожидается endpoint=capacity/period), пропущен', item)
+    return {endpoint: limit for endpoint, limit in limits.items() if limit[0] > 0 and limit[1] > 0}
+
+
+RATE_LIMITS = parse_limits(os.environ.get('RATE_LIMITS'))
+RATE_LIMITS_USERNAME = parse_limits(os.environ.get('RATE_LIMITS_USERNAME'), DEFAULT_USERNAME_LIMITS)
+
+_local = threading.local()
+_proxy_warned = False
+
+
+def _connect():
+    conn = sqlite3.connect(RATE_LIMIT_DATABASE, timeout=1.0, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    # Потерять ведра при сбое питания не страшно
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            allowed INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    return conn
+
+
+def _store():
+    """Соединение с хранилищем ведер текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    # После fork соединение родителя использовать нельзя
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        conn = _local.conn = _connect()
+        _local.pid = os.getpid()
+    return conn
+
+
+def take(key, capacity, period, now=None):
+    """Потратить токен из ведра key; вернуть 0 или сколько секунд ждать токена"""
+    now = time.time() if now is None else now
+    rate = capacity / period
+    # Наполнение, проверка и списание - одним оператором, атомарно для всех воркеров
+    tokens, allowed = _store().execute('''
+        INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :capacity - 1, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = MIN(:capacity, tokens + MAX(0, :now - updated) * :rate)
+                     - (MIN(:capacity, tokens + MAX(0, :now - updated) * :rate) >= 1),
+            allowed = MIN(:capacity, tokens + MAX(0, :now - updated) * :rate) >= 1,
+            updated = :now
+        RETURNING tokens, allowed
+    ''', {'key': key, 'capacity': capacity, 'now': now, 'rate': rate}).fetchone()
+    if random.random() < CLEANUP_PROBABILITY:
+        _cleanup(now)
+    return 0 if allowed else (1 - tokens) / rate
+
+
+def _cleanup(now):
+    # Ведро, не тронутое дольше самого длинного периода, уже полное - строка не нужна
+    limits = [*RATE_LIMITS.values(), *RATE_LIMITS_USERNAME.values()]
+    longest = max((period for _, period in limits), default=0)
+    _store().execute('DELETE FROM buckets WHERE updated < ?', (now - longest,))
+
+
+def client_ip():
+    """IP клиента с учетом RATE_LIMIT_PROXIES доверенных прокси"""
+    route = request.access_route
+    if RATE_LIMIT_PROXIES and len(route) > RATE_LIMIT_PROXIES:
+        return route[-RATE_LIMIT_PROXIES - 1]
+    if RATE_LIMIT_PROXIES_UNSET and 'X-Forwarded-For' in request.headers:
+        _warn_proxy()
+    return request.remote_addr or ''
+
+
+def _warn_proxy():
+    global _proxy_warned
+    if not _proxy_warned:
+        _proxy_warned = True
+        logger.error('Запрос пришел через прокси (X-Forwarded-For), но RATE_LIMIT_PROXIES не задан: '
+                     'все клиенты делят лимиты по IP прокси. Задайте число доверенных прокси '
+                     '(1 на Railway) или 0 при прямом доступе')
+
+
+def _reject(status, message, retry_after):
+    response = Response(message, status, mimetype='text/plain')
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _check():
+    limit = RATE_LIMITS.get(request.endpoint)
+    username_limit = RATE_LIMITS_USERNAME.get(request.endpoint)
+    if (limit is None and username_limit is None) or request.method != 'POST':
+        return None
+
+    # Сброс нагрузки - до любых запросов, в том числе к хранилищу ведер
+    if (SHED_QUEUE_DEPTH and writer.queue_depth() > SHED_QUEUE_DEPTH) or \
+            (SHED_LATENCY_MS and writer.latency() * 1000 > SHED_LATENCY_MS):
+        return _reject(503, 'Сервер перегружен, повторите попытку позже', SHED_RETRY_AFTER)
+
+    buckets = []
+    if limit is not None:
+        buckets.append((f'ip:{request.endpoint}:{client_ip()}', limit))
+    username = request.form.get('username', '').strip().lower()
+    if username and username_limit is not None:
+        buckets.append((f'user:{request.endpoint}:{username}', username_limit))
+    try:
+        wait = max((take(key, *limit) for key, limit in buckets), default=0)
+    except sqlite3.Error:
+        logger.exception('Хранилище ограничений недоступно, запрос пропущен')
+        return None
+    if wait:
+        return _reject(429, 'Слишком много попыток, повторите позже', wait)
+    return None
+
+
+def init_app(app):
+    """Проверять лимиты перед маршрутами из RATE_LIMITS"""
+    app.before_request(_check)
@@ -0,0 +1,75 @@
+"""Отчеты по делам и протоколам.
+
+Все отчеты читают готовые сводки из таблицы summaries, которые триггеры
+обновляют при каждой записи (см. migrations.add_summaries), поэтому
+стоимость отчета не зависит от числа дел и протоколов. Нулевые строки
+сводок (все записи удалены) в отчеты не попадают.
+"""
+import os
+
+REPORT_TOP = int(os.environ.get('REPORT_TOP', 20))
+REPORT_DAYS = int(os.environ.get('REPORT_DAYS', 30))
+
+CASE_STATUSES = ('open', 'in_progress', 'closed')
+
+
+def summary(conn, name):
+    """Сводка целиком: {ключ: значение}. Только для небольших сводок"""
+    return dict(conn.execute('SELECT key, value FROM summaries WHERE name = ? AND value > 0',
+                             (name,)).fetchall())
+
+
+def case_workload(conn):
+    """Нагрузка по сотрудникам: строки с числом дел всего и по статусам"""
+    counts = summary(conn, 'cases_by_employee_status')
+    ids = sorted({int(key.split(':', 1)[0]) for key in counts if key.split(':', 1)[0]})
+    names = {}
+    if ids:
+        placeholders = ', '.join('?' * len(ids))
+        names = dict(conn.execute(f'SELECT id, full_name FROM employees WHERE id IN ({placeholders})',
+                                  ids).fetchall())
+
+    rows = {}
+    for key, value in counts.items():
+        employee, status = key.split(':', 1)
+        row = rows.setdefault(employee, {
+            'employee_id': int(employee) if employee else None,
+            'employee': names.get(int(employee)) if employee else None,
+            'total': 0,
+            'statuses': dict.fromkeys(CASE_STATUSES, 0),
+        })
+        row['total'] += value
+        row['statuses'][status] = row['statuses'].get(status, 0) + value
+    return sorted(rows.values(), key=lambda row: -row['total'])
+
+
+def top_cases(conn, limit=REPORT_TOP):
+    """Дела с наибольшим числом протоколов"""
+    return conn.execute('''
+        SELECT c.id, c.title, c.case_number, s.value as protocols
+        FROM summaries s
+        JOIN cases c ON c.id = CAST(s.key AS INTEGER)
+        WHERE s.name = 'protocols_by_case' AND s.value > 0
+        ORDER BY s.value DESC LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def top_users(conn, limit=REPORT_TOP):
+    """Пользователи с наибольшим числом протоколов"""
+    return conn.execute('''
+        SELECT u.id, u.full_name, u.username, s.value as protocols
+        FROM summaries s
+        JOIN users u ON u.id = CAST(s.key AS INTEGER)
+        WHERE s.name = 'protocols_by_user' AND s.value > 0
+        ORDER BY s.value DESC LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def protocols_by_day(conn, days=REPORT_DAYS):
+    """Число протоколов за последние days дней, в которые они создавались"""
+    rows = conn.execute('''
+        SELECT key as day, value as protocols FROM summaries
+        WHERE name = 'protocols_by_day' AND value > 0
+        ORDER BY key DESC LIMIT ?
+    ''', (days,)).fetchall()
+    return list(reversed(rows))
@@ -0,0 +1,195 @@
+"""Полнотекстовый поиск по протоколам и делам.
+
+В SQLite - индексы FTS5, в PostgreSQL - GIN-индексы по выражению tsvector
+(см. migrations.add_search_indexes); результаты в обоих случаях одинаковые
+по составу полей, сниппеты размечаются одними и теми же маркерами.
+
+Индекс протоколов в SQLite не хранит текст (он сжат, см. compression.py),
+поэтому сниппет протокола строится в Python из распакованного текста
+страницы результатов.
+"""
+import os
+import re
+import unicodedata
+
+from markupsafe import Markup, escape
+
+import db
+from compression import unpack_text
+from migrations import search_document
+
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE = int(os.environ.get('SEARCH_MAX_PAGE', 50))
+
+# Маркеры подсветки в snippet(): заменяются на <mark> после экранирования текста
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+SNIPPET_WORDS = 24
+_SNIPPET = f"snippet({{fts}}, -1, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_WORDS})"
+_HEADLINE = (f"ts_headline('simple', COALESCE({{column}}, ''), q.query, "
+             f"'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=24, MinWords=8, "
+             f"FragmentDelimiter=…, MaxFragments=1')")
+
+
+def fts_query(text):
+    """Превратить пользовательский ввод в безопасный запрос MATCH.
+
+    Каждое слово ищется как префикс, все слова должны встретиться.
+    Пустая строка означает, что искать нечего.
+    """
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words[:16])
+
+
+def ts_query(text):
+    """То же для PostgreSQL: запрос to_tsquery с поиском слов по префиксу"""
+    words = re.findall(r'\w+', text or '')
+    return ' & '.join(f"'{word}':*" for word in words[:16])
+
+
+def _fold(word):
+    # Как токенизатор unicode61 с remove_diacritics: без регистра, диакритика
+    # снимается с латинских букв (ё и й остаются собой)
+    chars = []
+    for ch in word.lower():
+        base = unicodedata.normalize('NFD', ch)[0]
+        chars.append(base if base.isascii() else ch)
+    return ''.join(chars)
+
+
+def snippet(text, words, size=SNIPPET_WORDS):
+    """Фрагмент text в size слов вокруг первого совпадения со словами words (по префиксу).
+
+    Совпадения размечаются так же, как snippet() FTS5; None, если их нет.
+    """
+    if not text or not words:
+        return None
+    prefixes = tuple(_fold(word) for word in words)
+    tokens = list(re.finditer(r'\w+', text))
+    hits = {i for i, token in enumerate(tokens) if _fold(token.group(0)).startswith(prefixes)}
+    if not hits:
+        return None
+    start = max(0, min(min(hits) - size // 4, len(tokens) - size))
+    end = min(len(tokens), start + size)
+    parts = ['…' if start else text[:tokens[0].start()]]
+    pos = tokens[start].start()
+    for i in range(start, end):
+        token = tokens[i]
+        word = token.group(0)
+        parts.append(text[pos:token.start()])
+        parts.append(f'{_MARK_START}{word}{_MARK_END}' if i in hits else word)
+        pos = token.end()
+    parts.append('…' if end < len(tokens) else text[pos:])
+    return ''.join(parts)
+
+
+def _with_snippet(row, words):
+    row = dict(zip(row.keys(), row))
+    content = unpack_text(row.pop('content'))
+    row['snippet'] = snippet(content, words) or snippet(row['title'], words)
+    return row
+
+
+def highlight(snippet):
+    """Фильтр шаблона: экранировать сниппет и подсветить совпадения"""
+    if not snippet:
+        return ''
+    text = str(escape(snippet))
+    return Markup(text.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+class Results:
+    """Страница результатов поиска"""
+
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def _run(conn, sql, params, order, page, per_page):
+    page = max(1, min(page, SEARCH_MAX_PAGE))
+    rows = conn.execute(sql + f' ORDER BY {order} LIMIT ? OFFSET ?',
+                        (*params, per_page + 1, (page - 1) * per_page)).fetchall()
+    return Results(rows[:per_page], page, len(rows) > per_page)
+
+
+def search_protocols(conn, text, user_id=None, page=1, per_page=SEARCH_PAGE_SIZE):
+    """Протоколы по релевантности; user_id ограничивает поиск протоколами пользователя"""
+    postgres = db.is_postgres(conn)
+    query = ts_query(text) if postgres else fts_query(text)
+    if not query:
+        return Results([], 1, False)
+    columns = '''
+        SELECT p.id, p.title, p.protocol_number, p.created_at,
+               c.title as case_title, c.case_number as case_number,
+               u.full_name as user_name, u.username as user_username,
+    '''
+    if postgres:
+        document = search_document('protocols', 'p')
+        sql = columns + f'''
+               {_HEADLINE.format(column='p.content')} as snippet
+        FROM protocols p
+        CROSS JOIN (SELECT to_tsquery('simple', ?) AS query) q
+        JOIN cases c ON p.case_id = c.id
+        JOIN users u ON p.user_id = u.id
+        WHERE {document} @@ q.query
+        '''
+        order = f'ts_rank({document}, q.query) DESC, p.id DESC'
+    else:
+        sql = columns + '''
+               p.content
+        FROM protocols_fts
+        JOIN protocols p ON p.id = protocols_fts.rowid
+        JOIN cases c ON p.case_id = c.id
+        JOIN users u ON p.user_id = u.id
+        WHERE protocols_fts MATCH ?
+        '''
+        order = 'protocols_fts.rank'
+    params = [query]
+    if user_id is not None:
+        sql += ' AND p.user_id = ?'
+        params.append(user_id)
+    results = _run(conn, sql, params, order, page, per_page)
+    if not postgres:
+        words = re.findall(r'\w+', text)[:16]
+        results.items = [_with_snippet(row, words) for row in results.items]
+    return results
+
+
+def search_cases(conn, text, page=1, per_page=SEARCH_PAGE_SIZE):
+    """Дела по релевантности"""
+    postgres = db.is_postgres(conn)
+    query = ts_query(text) if postgres else fts_query(text)
+    if not query:
+        return Results([], 1, False)
+    columns = '''
+        SELECT c.id, c.title, c.case_number, c.status, c.created_at,
+               e.full_name as assigned_employee,
+    '''
+    if postgres:
+        document = search_document('cases', 'c')
+        sql = columns + f'''
+               {_HEADLINE.format(column='c.description')} as snippet
+        FROM cases c
+        CROSS JOIN (SELECT to_tsquery('simple', ?) AS query) q
+        LEFT JOIN employees e ON c.assigned_to = e.id
+        WHERE {document} @@ q.query
+        '''
+        order = f'ts_rank({document}, q.query) DESC, c.id DESC'
+    else:
+        sql = columns + f'''
+               {_SNIPPET.format(fts='cases_fts')} as snippet
+        FROM cases_fts
+        JOIN cases c ON c.id = cases_fts.rowid
+        LEFT JOIN employees e ON c.assigned_to = e.id
+        WHERE cases_fts MATCH ?
+        '''
+        order = 'cases_fts.rank'
+    return _run(conn, sql, [query], order, page, per_page)
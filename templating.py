@@ -0,0 +1,47 @@
+"""Настройка Jinja: кеш байткода, прогрев шаблонов и кеш фрагментов.
+
+Скомпилированные шаблоны сохраняются на диск (JINJA_CACHE_DIR), поэтому новый
+воркер не компилирует их заново, а при TEMPLATE_WARMUP все шаблоны загружаются
+сразу при старте, а не на первых запросах после деплоя.
+
+Фрагменты, которые не зависят от пользователя (шапка, список новостей,
+выпадающий список сотрудников), рендерятся один раз и переиспользуются:
+
+    {% call cached_fragment('cases:employees', 'employees') %}...{% endcall %}
+
+Ключ фрагмента дополняется версиями перечисленных таблиц (см. cache.py).
+"""
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from cache import cache
+
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR',
+                                 os.path.join(tempfile.gettempdir(), 'gvsu-jinja-cache'))
+TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', '1') != '0'
+
+
+def cached_fragment(key, *tables, caller):
+    """Отрендерить тело блока call один раз для текущих версий tables"""
+    return cache.get(('fragment', key), lambda: Markup(caller()), tables)
+
+
+def warmup(app):
+    """Загрузить (и при необходимости скомпилировать) все шаблоны"""
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def init_app(app):
+    """Подключить кеш байткода, глобальные функции и прогрев шаблонов"""
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    app.add_template_global(cached_fragment)
+    if TEMPLATE_WARMUP:
+        warmup(app)
@@ -0,0 +1,17 @@
+"""Общая настройка тестов.
+
+Приложение (app.py) читает настройки из окружения при импорте, поэтому
+временные файлы задаются здесь, до импорта тестовых модулей. Заданный
+снаружи DATABASE_URL (например, PostgreSQL - см. test_db.py) сохраняется.
+"""
+import os
+import sys
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix='gvsu-tests-')
+os.environ.setdefault('DATABASE_URL', os.path.join(_workdir, 'app.db'))
+os.environ.setdefault('RATE_LIMIT_DATABASE', os.path.join(_workdir, 'ratelimit.db'))
+os.environ.setdefault('METRICS_DIR', os.path.join(_workdir, 'metrics'))
+os.environ.setdefault('MAINTENANCE_INTERVAL', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,159 @@
+"""Маршруты приложения через тестовый клиент Flask.
+
+Записи идут через очередь писателя (WRITE_QUEUE включен), как в продакшене:
+задания выполняются в его потоке, без контекста приложения.
+"""
+import threading
+import uuid
+
+import pytest
+
+import app as application
+import db
+import ratelimit
+import writer
+from compression import pack_values
+from migrations import index_search
+
+
+@pytest.fixture
+def conn():
+    conn = db.connect()
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(writer, 'WRITE_QUEUE', True)
+    return application.app.test_client()
+
+
+def _user(conn):
+    user_id = db.insert(conn, 'INSERT INTO users (full_name, username, password, status) VALUES (?, ?, ?, ?)',
+                        ('Тест', f'user_{uuid.uuid4().hex[:12]}', 'x', 'approved'))
+    conn.commit()
+    return user_id
+
+
+def _case(conn):
+    case_id = db.insert(conn, 'INSERT INTO cases (title, status) VALUES (?, ?)', ('Дело', 'open'))
+    conn.commit()
+    return case_id
+
+
+def _protocol(conn, case_id, user_id):
+    columns = ('case_id', 'user_id', 'title', 'content')
+    protocol_id = db.insert(conn, 'INSERT INTO protocols (case_id, user_id, title, content) VALUES (?, ?, ?, ?)',
+                            pack_values(conn, 'protocols', columns, (case_id, user_id, 'Протокол', 'текст')))
+    index_search(conn, 'protocols', 'id = ?', (protocol_id,))
+    conn.commit()
+    return protocol_id
+
+
+def _login(client, user_id):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+
+def test_delete_protocol(client, conn):
+    user_id = _user(conn)
+    protocol_id = _protocol(conn, _case(conn), user_id)
+    _login(client, user_id)
+
+    response = client.post(f'/user/protocols/{protocol_id}/delete')
+    assert response.status_code == 302
+    assert not conn.execute('SELECT 1 FROM protocols WHERE id = ?', (protocol_id,)).fetchone()
+
+
+def test_delete_foreign_protocol(client, conn):
+    owner_id = _user(conn)
+    protocol_id = _protocol(conn, _case(conn), owner_id)
+    _login(client, _user(conn))
+
+    client.post(f'/user/protocols/{protocol_id}/delete')
+    assert conn.execute('SELECT 1 FROM protocols WHERE id = ?', (protocol_id,)).fetchone()
+
+
+def test_api_protocol_batch_uses_session_user(client, conn):
+    user_id = _user(conn)
+    case_id = _case(conn)
+    _login(client, user_id)
+
+    response = client.post('/api/v1/protocols/batch', json={'create': [
+        {'case_id': case_id, 'title': 'Без автора', 'content': 'текст'},
+        {'case_id': case_id, 'user_id': user_id + 1000, 'title': 'Чужой автор', 'content': 'текст'},
+    ]})
+    assert response.status_code == 200, response.get_json()
+    created = response.get_json()['created']
+    rows = conn.execute(f'SELECT user_id FROM protocols WHERE id IN ({", ".join("?" * len(created))})',
+                        created).fetchall()
+    assert [row[0] for row in rows] == [user_id, user_id]
+
+
+def test_api_user_batch_update_logs_user_out(client, conn):
+    user_id = _user(conn)
+    _login(client, user_id)
+    assert client.get('/user/dashboard').status_code == 200
+
+    admin = application.app.test_client()
+    with admin.session_transaction() as session:
+        session['admin'] = True
+    response = admin.post('/api/v1/users/batch', json={'update': [{'id': user_id, 'status': 'rejected'}]})
+    assert response.status_code == 200, response.get_json()
+    # Кеш пользователей сброшен: отклоненный выходит из системы сразу
+    assert client.get('/user/dashboard').status_code == 302
+
+
+def test_dashboard_etag_after_flash(client, conn):
+    user_id = _user(conn)
+    protocol_id = _protocol(conn, _case(conn), user_id)
+    _login(client, user_id)
+
+    # Удаление перенаправляет на кабинет с сообщением - оно выводится и забирается
+    response = client.post(f'/user/protocols/{protocol_id}/delete', follow_redirects=True)
+    assert 'Протокол удален' in response.get_data(as_text=True)
+    response = client.get('/user/dashboard')
+    assert response.headers.get('ETag')
+    response = client.get('/user/dashboard', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_parse_limits_skips_bad_entries():
+    limits = ratelimit.parse_limits('off,user_login=5/60,register=0/0', {'register': (3, 600)})
+    assert limits == {'user_login': (5, 60.0)}
+
+
+def test_username_limit_spans_addresses(client, monkeypatch):
+    monkeypatch.setitem(ratelimit.RATE_LIMITS, 'user_login', (100, 60))
+    monkeypatch.setitem(ratelimit.RATE_LIMITS_USERNAME, 'user_login', (2, 600))
+    username = f'victim_{uuid.uuid4().hex[:12]}'
+
+    def login(ip, username=username):
+        return client.post('/user/login', data={'username': username, 'password': 'x'},
+                           environ_base={'REMOTE_ADDR': ip}).status_code
+
+    assert [login('10.0.0.1'), login('10.0.0.2')] == [200, 200]
+    assert login('10.0.0.3') == 429
+    assert login('10.0.0.3', username=username + '_other') == 200
+
+
+def test_write_timeout_cancels_queued_job(client):
+    release = threading.Event()
+    ran = []
+
+    def blocking(conn):
+        release.wait(5)
+        return 'blocking'
+
+    with pytest.raises(writer.WriteTimeout) as started:
+        writer.run(blocking, timeout=0.1)
+    assert started.value.started
+    with pytest.raises(writer.WriteTimeout) as queued:
+        writer.run(lambda conn: ran.append(True), timeout=0.1)
+    assert not queued.value.started
+
+    release.set()
+    assert writer.run(lambda conn: 'next') == 'next'
+    assert ran == []
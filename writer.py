@@ -0,0 +1,205 @@
+"""Очередь записи с групповой фиксацией транзакций.
+
+Маршруты не пишут в БД своим соединением, а передают задание - функцию
+job(conn) - фоновому потоку-писателю своего процесса. Писатель забирает все
+накопившиеся задания, выполняет их одной транзакцией (каждое в своей точке
+сохранения) и фиксирует одним COMMIT: при потоке регистраций вместо одного
+fsync на строку получается один на пачку, а блокировку записи SQLite между
+воркерами gunicorn держит один поток на процесс.
+
+Вызывающий получает результат синхронно: run() возвращает значение job или
+поднимает его исключение. Ошибка одного задания откатывает только его точку
+сохранения. Если БД занята другим процессом (SQLITE_BUSY после
+SQLITE_TIMEOUT; в PostgreSQL - конфликт сериализации или взаимоблокировка),
+пачка повторяется с экспоненциальной задержкой.
+
+Задание выполняется в другом потоке: оно не должно обращаться к request,
+session и g и не должно само вызывать commit/rollback.
+
+Если результата нет за WRITE_TIMEOUT, run() поднимает WriteTimeout. Задание,
+которое писатель еще не начал, при этом отменяется и не выполнится
+(started=False). Уже начатое (started=True) может зафиксироваться позже:
+его исход неизвестен, и вызывающий не должен считать запись ни
+выполненной, ни отмененной.
+"""
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import db
+
+# Сколько заданий максимум фиксировать одной транзакцией
+WRITE_BATCH_MAX = int(os.environ.get('WRITE_BATCH_MAX', 200))
+# Сколько ждать попутные задания перед началом транзакции (0 - не ждать)
+WRITE_GROUP_WINDOW_MS = float(os.environ.get('WRITE_GROUP_WINDOW_MS', 0))
+WRITE_RETRIES = int(os.environ.get('WRITE_RETRIES', 5))
+WRITE_BACKOFF_MS = float(os.environ.get('WRITE_BACKOFF_MS', 20))
+# Сколько вызывающий ждет результат, секунд
+WRITE_TIMEOUT = float(os.environ.get('WRITE_TIMEOUT', 30))
+# WRITE_QUEUE=0 - выполнять задания сразу в вызывающем потоке
+WRITE_QUEUE = os.environ.get('WRITE_QUEUE', '1') != '0'
+# Сглаживание и срок годности оценки времени транзакции записи (см. latency())
+LATENCY_SMOOTHING = 0.2
+LATENCY_TTL = 10.0
+
+
+class WriteTimeout(TimeoutError):
+    """Результат задания не получен за отведенное время"""
+
+    def __init__(self, message, started):
+        super().__init__(message)
+        # True - задание уже выполнялось, и его исход неизвестен
+        self.started = started
+
+
+def _rollback(conn):
+    try:
+        conn.rollback()
+    except db.Error:
+        pass
+
+
+def execute_batch(conn, jobs):
+    """Выполнить задания одной транзакцией; вернуть [(успех, значение или исключение)]"""
+    for attempt in range(WRITE_RETRIES + 1):
+        outcomes = []
+        try:
+            db.begin_write(conn)
+            for job in jobs:
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    value = job(conn)
+                except db.OperationalError as e:
+                    if db.is_retryable(e):
+                        raise
+                    conn.execute('ROLLBACK TO write_job')
+                    outcomes.append((False, e))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_job')
+                    outcomes.append((False, e))
+                else:
+                    outcomes.append((True, value))
+                conn.execute('RELEASE write_job')
+            conn.commit()
+            return outcomes
+        except db.OperationalError as e:
+            _rollback(conn)
+            if not db.is_retryable(e) or attempt == WRITE_RETRIES:
+                return [(False, e)] * len(jobs)
+            # Экспоненциальная задержка со случайной добавкой, чтобы воркеры не совпадали
+            delay = WRITE_BACKOFF_MS * (2 ** attempt) * (0.5 + random.random())
+            time.sleep(delay / 1000)
+        except db.Error as e:
+            _rollback(conn)
+            return [(False, e)] * len(jobs)
+
+
+class WriteQueue:
+    """Очередь заданий и поток-писатель текущего процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.jobs = None
+        self.latency = 0.0
+        self.latency_at = 0.0
+
+    def _ensure_started(self):
+        # После fork поток родителя в дочернем процессе не существует
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.jobs = queue.SimpleQueue()
+                threading.Thread(target=self._loop, args=(self.jobs,),
+                                 name='db-writer', daemon=True).start()
+                self.pid = os.getpid()
+
+    def submit(self, job):
+        """Поставить задание в очередь; вернуть Future с его результатом"""
+        self._ensure_started()
+        future = Future()
+        self.jobs.put((job, future))
+        return future
+
+    def _loop(self, jobs):
+        conn = None
+        while True:
+            batch = [jobs.get()]
+            if WRITE_GROUP_WINDOW_MS:
+                time.sleep(WRITE_GROUP_WINDOW_MS / 1000)
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(jobs.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [(job, future) for job, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = db.connect()
+                outcomes = execute_batch(conn, [job for job, _ in batch])
+            except db.Error as e:
+                # Не удалось даже открыть соединение - попробуем заново со следующей пачкой
+                conn = None
+                outcomes = [(False, e)] * len(batch)
+            elapsed = time.perf_counter() - started
+            self.latency += LATENCY_SMOOTHING * (elapsed - self.latency)
+            self.latency_at = time.monotonic()
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+
+_queue = WriteQueue()
+
+
+def queue_depth():
+    """Сколько заданий ждут писателя текущего процесса"""
+    if _queue.pid != os.getpid() or _queue.jobs is None:
+        return 0
+    return _queue.jobs.qsize()
+
+
+def latency():
+    """Сглаженное время транзакции записи (с ожиданием блокировки и повторами), секунд.
+
+    Оценка старше LATENCY_TTL секунд не учитывается: без новых записей
+    нельзя судить, что БД все еще перегружена.
+    """
+    if _queue.pid != os.getpid() or time.monotonic() - _queue.latency_at > LATENCY_TTL:
+        return 0.0
+    return _queue.latency
+
+
+def run(job, timeout=WRITE_TIMEOUT):
+    """Выполнить job(conn) в транзакции записи и вернуть его результат"""
+    if not WRITE_QUEUE:
+        ok, value = execute_batch(db.get_db(), [job])[0]
+        if not ok:
+            raise value
+        return value
+    future = _queue.submit(job)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        if future.done():
+            # TimeoutError поднято самим заданием
+            raise
+        # Не начатое задание снимается с очереди; начатое может еще зафиксироваться
+        if future.cancel():
+            raise WriteTimeout(f'Запись не начата за {timeout:g} с и отменена', started=False) from None
+        raise WriteTimeout(f'Запись не завершилась за {timeout:g} с, ее исход неизвестен',
+                           started=True) from None
+
+
+def execute(sql, params=(), timeout=WRITE_TIMEOUT):
+    """Выполнить один изменяющий запрос; вернуть число затронутых строк"""
+    return run(lambda conn: conn.execute(sql, params).rowcount, timeout)